@@ -0,0 +1,225 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .prompt_aliases import AliasLookup
+
+EXT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(EXT_DIR, "data")
+ALIASES_FILE = os.path.join(DATA_DIR, "aliases.json")
+
+# The document lives in memory; every change bumps _VERSION and the background writer
+# persists the latest state after _FLUSH_DELAY_SECONDS, so a burst of edits costs one
+# atomic rewrite. The file is re-read when it changes on disk behind our back.
+_FLUSH_DELAY_SECONDS = 0.25
+# A failed write is retried, backing off up to _RETRY_MAX_SECONDS between attempts.
+_RETRY_MAX_SECONDS = 30.0
+_LOCK = threading.Lock()
+_FLUSH_LOCK = threading.Lock()
+_WAKE = threading.Event()
+_DOC = None
+_VERSION = 0
+_SIGNATURE = None
+_DIRTY = False
+_WRITER = None
+# Derived from _DOC and rebuilt lazily after each change.
+_BODY = None
+_ETAG = None
+_LOOKUP = None
+
+logger = logging.getLogger(__name__)
+
+
+def _file_signature():
+    try:
+        st = os.stat(ALIASES_FILE)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _set_doc(doc):
+    """Install a new document. Caller holds _LOCK."""
+    global _DOC, _VERSION, _BODY, _ETAG, _LOOKUP
+    _DOC = doc
+    _VERSION += 1
+    _BODY = _ETAG = _LOOKUP = None
+
+
+def _ensure_doc():
+    """Return the current document, (re)reading aliases.json if it changed. Caller holds _LOCK."""
+    global _SIGNATURE
+    if _DOC is not None and (_DIRTY or _file_signature() == _SIGNATURE):
+        return _DOC
+    signature = _file_signature()
+    try:
+        with open(ALIASES_FILE, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+    except Exception:
+        doc = {}
+    if not isinstance(doc, dict):
+        doc = {}
+    if doc != _DOC:
+        _set_doc(doc)
+    _SIGNATURE = signature
+    return _DOC
+
+
+def _ensure_body():
+    """Encode the current document once per version. Caller holds _LOCK."""
+    global _BODY, _ETAG
+    doc = _ensure_doc()
+    if _BODY is None:
+        _BODY = json.dumps(doc).encode("utf-8")
+        _ETAG = f'"{hashlib.blake2b(_BODY, digest_size=16).hexdigest()}"'
+    return _BODY, _ETAG
+
+
+def snapshot():
+    """Return (version, etag, JSON body bytes) for the current document."""
+    with _LOCK:
+        body, etag = _ensure_body()
+        return _VERSION, etag, body
+
+
+def lookup() -> AliasLookup:
+    """Compiled alias lookup for the current version."""
+    global _LOOKUP
+    with _LOCK:
+        doc = _ensure_doc()
+        if _LOOKUP is None:
+            _LOOKUP = AliasLookup.from_document(doc)
+        return _LOOKUP
+
+
+def _check_strings(value, what, allow_none=False):
+    if not isinstance(value, dict):
+        raise ValueError(f"{what} must be an object")
+    for key, item in value.items():
+        if not (isinstance(item, str) or (allow_none and item is None)):
+            raise ValueError(f"{what}[{key!r}] must be a string" + (" or null" if allow_none else ""))
+
+
+def _validate_document(doc):
+    if not isinstance(doc, dict):
+        raise ValueError("aliases must be a JSON object")
+    if "items" not in doc:
+        # Legacy flat {name: text} map.
+        _check_strings(doc, "aliases")
+        return
+    _check_strings(doc["items"], "items")
+    if doc.get("categories") is not None:
+        _check_strings(doc["categories"], "categories")
+    if doc.get("categoryList") is not None and not isinstance(doc["categoryList"], list):
+        raise ValueError("categoryList must be a list")
+
+
+def _commit(doc, if_match):
+    """Swap in doc unless if_match is stale; returns the new state or None. Caller holds _LOCK."""
+    global _DIRTY, _WRITER
+    _body, etag = _ensure_body()
+    if if_match not in (None, "*", etag):
+        return None
+    if doc != _DOC:
+        _set_doc(doc)
+        _DIRTY = True
+        if _WRITER is None:
+            _WRITER = threading.Thread(target=_writer_loop, name="cozygen-alias-writer", daemon=True)
+            _WRITER.start()
+            atexit.register(flush)
+        _WAKE.set()
+    _body, etag = _ensure_body()
+    return {"version": _VERSION, "etag": etag}
+
+
+def replace(doc, if_match=None):
+    """Replace the whole document. Raises ValueError on invalid input; None on an If-Match conflict."""
+    _validate_document(doc)
+    with _LOCK:
+        return _commit(doc, if_match)
+
+
+def patch(changes, if_match=None):
+    """Upsert or delete (null) individual items/categories and optionally replace categoryList.
+
+    A legacy flat document is converted to the {items, categories, categoryList} form.
+    Raises ValueError on invalid input; returns None on an If-Match conflict.
+    """
+    if not isinstance(changes, dict):
+        raise ValueError("patch must be a JSON object")
+    item_changes = changes.get("items") or {}
+    category_changes = changes.get("categories") or {}
+    _check_strings(item_changes, "items", allow_none=True)
+    _check_strings(category_changes, "categories", allow_none=True)
+    category_list = changes.get("categoryList")
+    if category_list is not None and not isinstance(category_list, list):
+        raise ValueError("categoryList must be a list")
+
+    with _LOCK:
+        current = _ensure_doc()
+        doc = dict(current) if "items" in current else {"items": current, "categories": {}, "categoryList": []}
+        items = dict(doc.get("items") or {})
+        categories = dict(doc.get("categories") or {})
+        for name, value in item_changes.items():
+            if value is None:
+                items.pop(name, None)
+                categories.pop(name, None)
+            else:
+                items[name] = value
+        for name, value in category_changes.items():
+            if value is None:
+                categories.pop(name, None)
+            else:
+                categories[name] = value
+        doc["items"] = items
+        doc["categories"] = categories
+        if category_list is not None:
+            doc["categoryList"] = category_list
+        return _commit(doc, if_match)
+
+
+def _write_file(payload):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp = f"{ALIASES_FILE}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ALIASES_FILE)
+
+
+def flush() -> bool:
+    """Write the current document now if it has unsaved changes; False if the write failed."""
+    global _DIRTY, _SIGNATURE
+    with _FLUSH_LOCK:
+        with _LOCK:
+            if not _DIRTY:
+                return True
+            payload = json.dumps(_DOC, indent=2)
+            version = _VERSION
+        try:
+            _write_file(payload)
+        except Exception as err:
+            logger.warning("CozyGen: failed to persist aliases: %s", err)
+            # Still dirty: have the writer try again after its backoff delay.
+            _WAKE.set()
+            return False
+        with _LOCK:
+            # Stay dirty (and ignore the file) until the latest version has been written.
+            if _VERSION == version:
+                _DIRTY = False
+                _SIGNATURE = _file_signature()
+        return True
+
+
+def _writer_loop():
+    delay = _FLUSH_DELAY_SECONDS
+    while True:
+        _WAKE.wait()
+        time.sleep(delay)
+        _WAKE.clear()
+        delay = _FLUSH_DELAY_SECONDS if flush() else min(max(delay * 2, 1.0), _RETRY_MAX_SECONDS)
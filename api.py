@@ -1,33 +1,77 @@
 import asyncio
 import contextlib
+import hashlib
+import inspect
+import itertools
 import json
 import logging
 import mimetypes
 import os
 import re
-import shutil
 import subprocess
+import threading
 import time
 import uuid
 from pathlib import Path
 from typing import Set
 
 import comfy.samplers
+import execution
 import folder_paths
-import server  # noqa: F401 - keep import side-effects
+import server
 from aiohttp import web
-from PIL import Image, ImageDraw, ImageOps
+from PIL import Image, ImageSequence
 
 from ComfyUI_CozyGen import auth
-from .prompt_raw_store import get_prompt_raw_by_file, remove_prompt_file, store_prompt_raw
+from .alias_store import ALIASES_FILE
+from .alias_store import lookup as alias_lookup
+from .alias_store import patch as patch_alias_document
+from .alias_store import replace as replace_alias_document
+from .alias_store import snapshot as alias_snapshot
+from .prompt_raw_store import get_prompt_raw_by_file, remove_prompt_files, store_prompt_raw
+from .prompt_raw_store import stats as prompt_raw_store_stats
+from .prompt_tokens import prompt_tokens
+from .tag_index import COMPLETE_TOP_K, TagIndex, load_index
+from .thumb_render import (
+    AUDIO_EXTS,
+    WAVEFORM_BUCKETS,
+    ensure_peaks,
+    ffmpeg_exe,
+    peaks_path,
+    placeholder_from,
+    render_thumb,
+    thumb_path,
+)
+from .thumb_store import (
+    THUMBS_DIR,
+    fingerprint_for,
+    get_placeholder,
+    placeholders_for,
+    reclaim_source,
+    record_hit,
+    record_miss,
+    render_path,
+    set_placeholder,
+    start_sweeper,
+)
+from .thumb_store import clear as clear_thumb_store
+from .thumb_store import register as register_thumb
+from .thumb_store import stats as thumb_store_stats
+from .workflow_store import listing as workflow_listing
+from .workflow_store import load as load_workflow
+from .workflow_store import start_watcher as start_workflow_watcher
+from .workflow_sweep import MAX_ITEMS as MAX_SWEEP_ITEMS
+from .workflow_sweep import MODES as SWEEP_MODES
+from .workflow_sweep import Sweep, combination_count, parse_axes
+from .workflow_sweep import combinations as sweep_combinations
+from .workflow_sweep import get as get_sweep
+from .workflow_sweep import register as register_sweep
 
 routes = web.RouteTableDef()
 logger = logging.getLogger(__name__)
 
 EXT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(EXT_DIR, "data")
-THUMBS_DIR = os.path.join(DATA_DIR, "thumbs")
-ALIASES_FILE = os.path.join(DATA_DIR, "aliases.json")
 WORKFLOW_TYPES_FILE = os.path.join(DATA_DIR, "workflow_types.json")
 WORKFLOW_PRESETS_FILE = os.path.join(DATA_DIR, "workflow_presets.json")
 WORKFLOW_MODE_CHOICES = {
@@ -37,6 +81,7 @@ WORKFLOW_MODE_CHOICES = {
     "image-to-video",
 }
 os.makedirs(THUMBS_DIR, exist_ok=True)
+start_workflow_watcher()
 if not os.path.exists(ALIASES_FILE):
     with open(ALIASES_FILE, "w", encoding="utf-8") as f:
         json.dump({}, f)
@@ -50,167 +95,83 @@ if not os.path.exists(WORKFLOW_PRESETS_FILE):
 # Danbooru tag reference (used for in-app tag browsing + alias validation)
 DANBOORU_TAGS_FILE = os.path.join(DATA_DIR, "danbooru_tags.md")
 
-_DANBOORU_TAGS_CACHE = None
-_DANBOORU_TAGS_MTIME = None
-_DANBOORU_TAGS_LOCK = asyncio.Lock()
-
-_RE_DANBOORU_CATEGORY = re.compile(r"^##\s+(.+?)(?:\s+\((\d+)\))?\s*$")
-_RE_DANBOORU_TAG = re.compile(r"^-\s+`([^`]+)`\s+—\s+(\d+)\s*$")
-_RE_DANBOORU_TIME_TAG = re.compile(r"^(?:\d{1,2}:\d{2}(?:am|pm)?|\d+:)$", re.I)
-
-_DANBOORU_CATEGORY_MAP = {
-    "anatomy_body": "body",
-    "camera_composition": "camera",
-    "clothing_accessories": "clothing",
-    "color": "color",
-    "expression_emotion": "expression",
-    "lighting": "lighting",
-    "location_scene": "scene",
-    "meta_quality": "quality",
-    "name_title_misc": "names",
-    "other": "general",
-    "pose_action": "pose",
-    "style_medium": "style",
-    "text_symbols": "text",
-    "subject_count": "meta",
-    "weapons_tools": "props",
-    "violence_gore": "violence",
-    "nsfw_suggestive": "nsfw",
-    "nsfw_nudity": "nsfw",
-    "nsfw_explicit": "nsfw",
-}
+DANBOORU_TAGS_INDEX_FILE = os.path.join(DATA_DIR, "danbooru_tags.idx")
 
+# The index is loaded eagerly by a watcher thread started at import. It polls the
+# reference every _DANBOORU_TAGS_POLL_SECONDS and rebuilds on change while requests keep
+# being served from the previous index, which is then swapped out in one assignment.
+_DANBOORU_TAGS_CACHE = None
+_DANBOORU_TAGS_SIGNATURE = None
+_DANBOORU_TAGS_READY = threading.Event()
+_DANBOORU_TAGS_POLL_SECONDS = 2.0
+_DANBOORU_TAGS_WATCHER = None
 
-def _normalize_danbooru_ui_category(raw_category: str, tag: str) -> str:
-    raw = (raw_category or "").strip().lower()
-    tl = (tag or "").strip().lower()
 
-    if not raw:
-        return "general"
+def _load_danbooru_tags(md_path: str, idx_path: str):
+    if not os.path.exists(md_path):
+        raise FileNotFoundError(md_path)
+    index = load_index(md_path, idx_path)
+    # Warm the index here, off the event loop, rather than on the first request.
+    index.warm()
+    return index
 
-    if raw.startswith("namespace"):
-        # The source file explodes any "namespaced" tag (contains ':') into a unique category,
-        # which clutters the UI. Collapse them into a small set of common-sense buckets.
-        if tl.startswith(("<", ">", ":")):
-            return "expression"
-        if _RE_DANBOORU_TIME_TAG.match(tl):
-            return "general"
-        return "fandom"
 
-    mapped = _DANBOORU_CATEGORY_MAP.get(raw)
-    if mapped:
-        return mapped
+def _danbooru_tags_signature():
+    try:
+        st = os.stat(DANBOORU_TAGS_FILE)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
 
-    # Fallback: keep unknown categories (should be rare) but normalize to lowercase.
-    return raw
 
+def _refresh_danbooru_tags():
+    """Reload the index if the reference changed since the last load."""
+    global _DANBOORU_TAGS_CACHE, _DANBOORU_TAGS_SIGNATURE
+    signature = _danbooru_tags_signature()
+    if _DANBOORU_TAGS_READY.is_set() and signature == _DANBOORU_TAGS_SIGNATURE:
+        return
+    try:
+        _DANBOORU_TAGS_CACHE = _load_danbooru_tags(DANBOORU_TAGS_FILE, DANBOORU_TAGS_INDEX_FILE)
+    except Exception as e:
+        logger.error("Failed to load danbooru_tags.md: %s", e)
+        if signature is None:
+            _DANBOORU_TAGS_CACHE = None
+        # Otherwise keep serving the previous index (e.g. a half-written file); the
+        # next change to the reference retries.
+    _DANBOORU_TAGS_SIGNATURE = signature
+    _DANBOORU_TAGS_READY.set()
 
-def _parse_danbooru_tags_md(path: str) -> dict:
-    if not os.path.exists(path):
-        raise FileNotFoundError(path)
 
-    categories = {}
-    all_items = []
-    tag_set_lower = set()
+def _watch_danbooru_tags():
+    while True:
+        try:
+            _refresh_danbooru_tags()
+        except Exception as e:
+            logger.warning("CozyGen: danbooru tag watcher failed: %s", e)
+        time.sleep(_DANBOORU_TAGS_POLL_SECONDS)
 
-    current_category_raw = ""
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.rstrip("\n")
-                m_cat = _RE_DANBOORU_CATEGORY.match(line.strip())
-                if m_cat:
-                    current_category_raw = (m_cat.group(1) or "").strip()
-                    continue
 
-                m_tag = _RE_DANBOORU_TAG.match(line.strip())
-                if not m_tag:
-                    continue
-                tag = (m_tag.group(1) or "").strip()
-                if not tag:
-                    continue
-                try:
-                    count = int(m_tag.group(2) or "0")
-                except Exception:
-                    count = 0
-
-                category = _normalize_danbooru_ui_category(current_category_raw, tag)
-                entry = {
-                    "tag": tag,
-                    "tag_lower": tag.lower(),
-                    "count": count,
-                    "category": category,
-                    "category_raw": current_category_raw or "",
-                }
-                all_items.append(entry)
-                tag_set_lower.add(entry["tag_lower"])
-                if category:
-                    if category not in categories:
-                        categories[category] = {
-                            "key": category,
-                            "declared_count": None,
-                            "items": [],
-                        }
-                    categories[category]["items"].append(entry)
-    except Exception:
-        raise
-
-    # Sort categories by declared count (fallback to actual count)
-    category_keys = list(categories.keys())
-    category_keys.sort(
-        key=lambda k: (
-            -(categories[k].get("declared_count") or len(categories[k].get("items") or [])),
-            k.lower(),
-        )
+def start_danbooru_tags_watcher():
+    """Start loading the tag index in the background and keep it fresh (idempotent)."""
+    global _DANBOORU_TAGS_WATCHER
+    if _DANBOORU_TAGS_WATCHER is not None:
+        return
+    _DANBOORU_TAGS_WATCHER = threading.Thread(
+        target=_watch_danbooru_tags, name="cozygen-tag-index-watcher", daemon=True
     )
+    _DANBOORU_TAGS_WATCHER.start()
 
-    # Sort items globally by popularity
-    items_sorted = sorted(all_items, key=lambda e: (-int(e.get("count") or 0), e.get("tag_lower") or ""))
-
-    # Pre-sort each category for popularity browsing
-    for k in category_keys:
-        categories[k]["items"] = sorted(
-            categories[k].get("items") or [],
-            key=lambda e: (-int(e.get("count") or 0), e.get("tag_lower") or ""),
-        )
-
-    tag_count_map = {e["tag_lower"]: int(e.get("count") or 0) for e in all_items}
 
-    return {
-        "categories": categories,
-        "category_keys": category_keys,
-        "items": all_items,
-        "items_sorted": items_sorted,
-        "tag_set_lower": tag_set_lower,
-        "tag_count_map": tag_count_map,
-    }
+async def _get_danbooru_tags_index():
+    """Return the loaded TagIndex, or None when the reference is unavailable."""
+    if not _DANBOORU_TAGS_READY.is_set():
+        # Only requests arriving before the startup load finishes wait for it.
+        start_danbooru_tags_watcher()
+        await asyncio.to_thread(_DANBOORU_TAGS_READY.wait)
+    return _DANBOORU_TAGS_CACHE
 
 
-async def _get_danbooru_tags_index() -> dict:
-    global _DANBOORU_TAGS_CACHE, _DANBOORU_TAGS_MTIME
-    try:
-        mtime = os.path.getmtime(DANBOORU_TAGS_FILE)
-    except Exception:
-        mtime = None
-    async with _DANBOORU_TAGS_LOCK:
-        if _DANBOORU_TAGS_CACHE is not None and _DANBOORU_TAGS_MTIME == mtime:
-            return _DANBOORU_TAGS_CACHE
-        try:
-            data = await asyncio.to_thread(_parse_danbooru_tags_md, DANBOORU_TAGS_FILE)
-        except Exception as e:
-            logger.error("Failed to load danbooru_tags.md: %s", e)
-            data = {
-                "categories": {},
-                "category_keys": [],
-                "items": [],
-                "items_sorted": [],
-                "tag_set_lower": set(),
-                "tag_count_map": {},
-                "_error": str(e),
-            }
-        _DANBOORU_TAGS_CACHE = data
-        _DANBOORU_TAGS_MTIME = mtime
-        return data
+start_danbooru_tags_watcher()
 
 
 def _load(path, dflt):
@@ -326,6 +287,7 @@ def _gallery_cache_key(
     per_page: int,
     bust: str,
     include_meta: bool,
+    include_placeholder: bool = False,
 ):
     return (
         subfolder or "",
@@ -336,6 +298,7 @@ def _gallery_cache_key(
         int(per_page),
         bust or "",
         bool(include_meta),
+        bool(include_placeholder),
     )
 
 
@@ -607,6 +570,13 @@ def _attach_media_meta(items, base: str):
     return enriched
 
 
+def _attach_placeholders(items):
+    if not items:
+        return items
+    placeholders = placeholders_for("output", items)
+    return [{**item, "placeholder": ph} if ph else item for item, ph in zip(items, placeholders)]
+
+
 def _gallery_cache_get(key):
     entry = _GALLERY_CACHE.get(key)
     if not entry:
@@ -769,6 +739,7 @@ async def gallery_list(request: web.Request):
     recursive = request.rel_url.query.get("recursive", "0") in ("1", "true", "True")
     kind = (request.rel_url.query.get("kind", "all") or "all").lower()
     include_meta = request.rel_url.query.get("include_meta", "0") in ("1", "true", "True")
+    include_placeholder = request.rel_url.query.get("include_placeholder", "0") in ("1", "true", "True")
     try:
         page = max(1, int(request.rel_url.query.get("page", "1")))
         per_page = int(request.rel_url.query.get("per_page", "20"))
@@ -793,6 +764,7 @@ async def gallery_list(request: web.Request):
         per_page,
         cache_bust,
         include_meta,
+        include_placeholder,
     )
     cached = _gallery_cache_get(cache_key)
     if cached:
@@ -803,6 +775,8 @@ async def gallery_list(request: web.Request):
     items_page, total = _slice_items(dirs, files_sorted, files_total, page, per_page)
     if include_meta:
         items_page = _attach_media_meta(items_page, base)
+    if include_placeholder:
+        items_page = _attach_placeholders(items_page)
     total_pages = (total + per_page - 1) // per_page if per_page > 0 else 1
     data = {
         "items": items_page,
@@ -853,6 +827,11 @@ async def store_prompt_raw_payload(request: web.Request):
     return web.json_response({"ok": True})
 
 
+@routes.get("/cozygen/api/prompt_raw/stats")
+async def prompt_raw_stats(_request: web.Request):
+    return web.json_response(prompt_raw_store_stats())
+
+
 @routes.post("/cozygen/api/gallery/delete")
 async def gallery_delete(request: web.Request):
     payload = await request.json()
@@ -877,6 +856,7 @@ async def gallery_delete(request: web.Request):
         os.remove(target)
     except Exception as err:
         return web.json_response({"error": f"unable to delete file: {err}"}, status=500)
+    await asyncio.to_thread(reclaim_source, "output", subfolder, filename)
 
     # Clear gallery cache so list updates immediately.
     global _GALLERY_CACHE
@@ -885,7 +865,7 @@ async def gallery_delete(request: web.Request):
 
 
 def _delete_gallery_files(base: str, folder: str, recursive: bool):
-    deleted = 0
+    removed = []
     errors = []
     for root, dirs, files in os.walk(folder):
         if not recursive:
@@ -901,11 +881,12 @@ def _delete_gallery_files(base: str, folder: str, recursive: bool):
                     rel_dir = ""
                 else:
                     rel_dir = rel_dir.replace("\\", "/")
-                remove_prompt_file(name, rel_dir)
-                deleted += 1
+                removed.append((name, rel_dir))
+                reclaim_source("output", rel_dir, name)
             except Exception as err:
                 errors.append(f"{target}: {err}")
-    return {"deleted": deleted, "errors": errors}
+    remove_prompt_files(removed)
+    return {"deleted": len(removed), "errors": errors}
 
 
 @routes.post("/cozygen/api/gallery/delete_all")
@@ -1045,24 +1026,247 @@ async def upload_image(request: web.Request):
 
 # ---------------- Workflows
 @routes.get("/cozygen/workflows")
-async def workflows(_):
-    d = os.path.join(EXT_DIR, "workflows")
-    if not os.path.isdir(d):
-        return web.json_response({"workflows": []})
-    return web.json_response({"workflows": [f for f in os.listdir(d) if f.endswith(".json")]})
+async def workflows(request: web.Request):
+    _names, body, etag = workflow_listing()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+def _encode_workflow(name: str, compressed: bool):
+    workflow = load_workflow(name)
+    return None if workflow is None else workflow.encoded(compressed)
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honouring q-values (`gzip;q=0` refuses it)."""
+    wildcard = None
+    for entry in accept_encoding.split(","):
+        coding, _, params = entry.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding in ("gzip", "x-gzip"):
+            return q > 0
+        if coding == "*":
+            wildcard = q > 0
+    return bool(wildcard)
 
 
 @routes.get("/cozygen/workflows/{filename}")
 async def workflow_one(request: web.Request):
-    fn = request.match_info["filename"]
-    path = os.path.join(EXT_DIR, "workflows", fn)
-    if not os.path.isfile(path):
-        return web.json_response({"error": "not found"}, status=404)
+    compressed = _accepts_gzip(request.headers.get("Accept-Encoding", ""))
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return web.json_response(json.load(f))
-    except json.JSONDecodeError:
+        encoded = await asyncio.to_thread(_encode_workflow, request.match_info["filename"], compressed)
+    except ValueError:
         return web.json_response({"error": "bad json"}, status=400)
+    if encoded is None:
+        return web.json_response({"error": "not found"}, status=404)
+    body, etag, gzipped = encoded
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+# ---------------- Queue
+async def _enqueue_prompt(prompt: dict, prompt_id: str, extra_data=None, front: bool = False):
+    """Validate and queue a prompt on ComfyUI's own queue, as its POST /prompt does.
+
+    Returns (response dict, HTTP status) shaped like /prompt's reply.
+    """
+    instance = server.PromptServer.instance
+    json_data = {"prompt": prompt, "prompt_id": prompt_id, "extra_data": dict(extra_data or {})}
+    trigger = getattr(instance, "trigger_on_prompt", None)
+    if trigger is not None:
+        json_data = trigger(json_data)
+    prompt = json_data["prompt"]
+    extra_data = json_data.get("extra_data") or {}
+
+    # validate_prompt(prompt) became async validate_prompt(prompt_id, prompt, partial_targets).
+    arity = len(inspect.signature(execution.validate_prompt).parameters)
+    args = (prompt_id, prompt, None)[:arity] if arity > 1 else (prompt,)
+    valid = execution.validate_prompt(*args)
+    if inspect.isawaitable(valid):
+        valid = await valid
+    if not valid[0]:
+        logger.warning("CozyGen: invalid prompt: %s", valid[1])
+        return {"error": valid[1], "node_errors": valid[3]}, 400
+
+    number = instance.number
+    instance.number += 1
+    if front:
+        number = -number
+    item = (number, prompt_id, prompt, extra_data, valid[2])
+    sensitive_keys = getattr(execution, "SENSITIVE_EXTRA_DATA_KEYS", None)
+    if sensitive_keys is not None:
+        sensitive = {key: extra_data.pop(key) for key in sensitive_keys if key in extra_data}
+        extra_data["create_time"] = int(time.time() * 1000)
+        item += (sensitive,)
+    instance.prompt_queue.put(item)
+    return {"prompt_id": prompt_id, "number": number, "node_errors": valid[3]}, 200
+
+
+async def _read_queue_request(request: web.Request):
+    """Parse a queue/sweep body; returns (payload, form_values, workflow, None) or an error response last."""
+    try:
+        payload = await request.json()
+    except Exception:
+        payload = None
+    if not isinstance(payload, dict):
+        return None, None, None, web.json_response({"error": "invalid json payload"}, status=400)
+    form_values = payload.get("form_values") or {}
+    if not isinstance(form_values, dict):
+        return None, None, None, web.json_response({"error": "form_values must be an object"}, status=400)
+    try:
+        workflow = await asyncio.to_thread(load_workflow, payload.get("workflow"))
+    except ValueError as e:
+        return None, None, None, web.json_response({"error": str(e)}, status=400)
+    if workflow is None:
+        return None, None, None, web.json_response({"error": "workflow not found"}, status=404)
+    return payload, form_values, workflow, None
+
+
+def _queue_extra_data(payload: dict):
+    return {"client_id": payload["client_id"]} if payload.get("client_id") else None
+
+
+def _queued_prompt_ids():
+    """(pending ids, running ids) currently in ComfyUI's queue."""
+    queue = server.PromptServer.instance.prompt_queue
+    current = getattr(queue, "get_current_queue_volatile", None) or queue.get_current_queue
+    running, pending = current()
+    return {item[1] for item in pending}, {item[1] for item in running}
+
+
+@routes.post("/cozygen/api/queue")
+async def queue_workflow(request: web.Request):
+    """Generate from a workflow file and form values without shipping the graph.
+
+    Body: {"workflow": "<file>.json", "form_values": {...}, "prompt_id"?, "client_id"?, "front"?}.
+    Injects the values into the cached graph, expands aliases, records prompt_raw and
+    queues the result; replies like /prompt plus the resolved "form_values".
+    """
+    payload, form_values, workflow, error = await _read_queue_request(request)
+    if error is not None:
+        return error
+    try:
+        prompt, resolved, prompt_raw = workflow.render(form_values, alias_lookup())
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    prompt_id = str(payload.get("prompt_id") or uuid.uuid4())
+    response, status = await _enqueue_prompt(
+        prompt, prompt_id, _queue_extra_data(payload), front=bool(payload.get("front"))
+    )
+    if status == 200:
+        # Only prompts that will actually run get a prompt_raw record.
+        if prompt_raw:
+            store_prompt_raw(prompt_id, prompt_raw)
+        response["form_values"] = resolved
+    return web.json_response(response, status=status)
+
+
+async def _run_sweep(sweep, workflow, form_values, overrides, lookup, extra_data):
+    """Render and enqueue each combination as the generator yields it."""
+    status = "done"
+    try:
+        for override in overrides:
+            if sweep.cancelled:
+                status = "cancelled"
+                break
+            prompt_id = str(uuid.uuid4())
+            try:
+                prompt, _resolved, prompt_raw = workflow.render({**form_values, **override}, lookup)
+            except ValueError as e:
+                sweep.record(prompt_id, str(e))
+                continue
+            response, code = await _enqueue_prompt(prompt, prompt_id, extra_data)
+            if code == 200 and prompt_raw:
+                store_prompt_raw(prompt_id, prompt_raw)
+            sweep.record(prompt_id, None if code == 200 else response.get("error"))
+            # Let other requests in between items.
+            await asyncio.sleep(0)
+    except Exception as e:
+        logger.exception("CozyGen: sweep %s failed", sweep.id)
+        sweep.record(None, str(e))
+        status = "error"
+    sweep.finish(status)
+
+
+@routes.post("/cozygen/api/sweep")
+async def sweep_workflow(request: web.Request):
+    """Queue every combination of sweep axes over a base form; returns a sweep id at once.
+
+    Body: /cozygen/api/queue's fields plus "axes" (see parse_axes) and
+    "mode": "cartesian" (default) or "zip". Combinations are generated and queued in the
+    background; GET /cozygen/api/sweep/{sweep_id} reports progress.
+    """
+    payload, form_values, workflow, error = await _read_queue_request(request)
+    if error is not None:
+        return error
+    mode = payload.get("mode") or "cartesian"
+    if mode not in SWEEP_MODES:
+        return web.json_response({"error": f"mode must be one of {', '.join(SWEEP_MODES)}"}, status=400)
+    try:
+        axes = parse_axes(payload.get("axes"), mode)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    total = combination_count(axes, mode)
+    if total > MAX_SWEEP_ITEMS:
+        return web.json_response(
+            {"error": f"sweep has {total} combinations; the limit is {MAX_SWEEP_ITEMS}"}, status=400
+        )
+
+    lookup = alias_lookup()
+    overrides = sweep_combinations(axes, mode)
+    # Render the first combination up front so a broken form fails the request, not every item.
+    first = next(overrides)
+    try:
+        workflow.render({**form_values, **first}, lookup)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    sweep = register_sweep(Sweep(workflow.name, total, mode))
+    sweep.task = asyncio.create_task(
+        _run_sweep(
+            sweep, workflow, form_values, itertools.chain((first,), overrides), lookup, _queue_extra_data(payload)
+        )
+    )
+    return web.json_response({"sweep_id": sweep.id, "total": total, "mode": mode}, status=202)
+
+
+@routes.get("/cozygen/api/sweep/{sweep_id}")
+async def sweep_status(request: web.Request):
+    """Progress of a sweep; ?prompt_ids=1 also lists the queued prompt ids."""
+    sweep = get_sweep(request.match_info["sweep_id"])
+    if sweep is None:
+        return web.json_response({"error": "sweep not found"}, status=404)
+    pending, running = _queued_prompt_ids()
+    include_ids = request.rel_url.query.get("prompt_ids", "0") in ("1", "true", "True")
+    return web.json_response(sweep.snapshot(pending, running, include_ids))
+
+
+@routes.delete("/cozygen/api/sweep/{sweep_id}")
+async def sweep_cancel(request: web.Request):
+    """Stop queueing a sweep's remaining combinations; prompts already queued stay queued."""
+    sweep = get_sweep(request.match_info["sweep_id"])
+    if sweep is None:
+        return web.json_response({"error": "sweep not found"}, status=404)
+    sweep.cancelled = True
+    if sweep.task is not None and not sweep.task.done():
+        await asyncio.wait({sweep.task})
+    pending, running = _queued_prompt_ids()
+    return web.json_response(sweep.snapshot(pending, running))
 
 
 # ---------------- Choices
@@ -1091,27 +1295,74 @@ async def get_choices(request: web.Request):
 
 # ---------------- Aliases
 @routes.get("/cozygen/api/aliases")
-async def get_aliases(_):
-    return web.json_response(_load(ALIASES_FILE, {}))
+async def get_aliases(request: web.Request):
+    version, etag, body = alias_snapshot()
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-CozyGen-Aliases-Version": str(version)}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+async def _write_aliases(request: web.Request, apply):
+    """Run replace_alias_document/patch for a request, honouring If-Match."""
+    try:
+        state = apply(await request.json(), if_match=request.headers.get("If-Match"))
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    if state is None:
+        return web.json_response({"error": "aliases were changed by someone else; reload and retry"}, status=412)
+    headers = {"ETag": state["etag"], "X-CozyGen-Aliases-Version": str(state["version"])}
+    return web.json_response({"status": "ok", "version": state["version"]}, headers=headers)
 
 
 @routes.post("/cozygen/api/aliases")
-async def post_aliases(request):
-    _save(ALIASES_FILE, await request.json())
-    return web.json_response({"status": "ok"})
+async def post_aliases(request: web.Request):
+    return await _write_aliases(request, replace_alias_document)
+
+
+@routes.patch("/cozygen/api/aliases")
+async def patch_aliases(request: web.Request):
+    """Upsert or delete (null) single aliases: {"items": {...}, "categories": {...}, "categoryList": [...]}."""
+    return await _write_aliases(request, patch_alias_document)
+
+
+@routes.post("/cozygen/api/aliases/expand")
+async def expand_aliases(request: web.Request):
+    """Expand alias references exactly like the browser's applyPromptAliases.
+
+    Accepts {"text": str}, {"texts": [str, ...]} or {"texts": {name: str}}.
+    """
+    try:
+        payload = await request.json()
+    except Exception:
+        return web.json_response({"error": "invalid json payload"}, status=400)
+    if not isinstance(payload, dict):
+        return web.json_response({"error": "invalid json payload"}, status=400)
+    texts = payload.get("texts")
+    if texts is None and isinstance(payload.get("text"), str):
+        texts = [payload["text"]]
+    names = None
+    if isinstance(texts, dict):
+        names = list(texts.keys())
+        texts = list(texts.values())
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return web.json_response({"error": "texts must be a list or object of strings"}, status=400)
+
+    lookup = alias_lookup()
+    results = [lookup.expand(text) for text in texts]
+    if names is not None:
+        return web.json_response({"results": dict(zip(names, results))})
+    return web.json_response({"results": results})
 
 
 # ---------------- Danbooru tags (browse + validate)
-def _suggest_danbooru_tags(term: str, index: dict, limit: int = 8):
+def _suggest_danbooru_tags(term: str, index: TagIndex, limit: int = 8):
     if not term:
         return []
     q = term.strip().lower()
     if not q:
         return []
 
-    tag_set = index.get("tag_set_lower") or set()
-    items_sorted = index.get("items_sorted") or []
-
     # Common delimiter variants
     candidates = []
     for variant in (
@@ -1120,21 +1371,17 @@ def _suggest_danbooru_tags(term: str, index: dict, limit: int = 8):
         q.replace(" ", "_"),
         q.replace(" ", "-"),
     ):
-        if variant != q and variant in tag_set:
+        if variant != q and variant in index:
             candidates.append(variant)
 
-    # Substring search through popularity list (fast enough for a few invalid tags)
+    # Typos: tags within two edits, closest and then most popular first
+    for row in index.fuzzy(re.sub(r"\s+", "_", q), limit=limit):
+        candidates.append(index.tags[row])
+
+    # Substring matches in popularity order (every part of q, or q itself)
     parts = [p for p in re.split(r"[_\-\s]+", q) if p]
-    for entry in items_sorted:
-        tl = entry.get("tag_lower") or ""
-        if not tl:
-            continue
-        if parts and not all(p in tl for p in parts):
-            continue
-        if q in tl or (parts and all(p in tl for p in parts)):
-            candidates.append(entry.get("tag") or tl)
-        if len(candidates) >= (limit * 4):
-            break
+    for row in index.match(parts or [q], limit=max(1, limit * 4 - len(candidates))).tolist():
+        candidates.append(index.tags[row])
 
     # Deduplicate while preserving popularity order
     seen = set()
@@ -1153,27 +1400,20 @@ def _suggest_danbooru_tags(term: str, index: dict, limit: int = 8):
 @routes.get("/cozygen/api/tags/categories")
 async def get_tag_categories(_):
     index = await _get_danbooru_tags_index()
-    if index.get("_error"):
+    if index is None:
         return web.json_response({"error": "danbooru tag reference unavailable"}, status=500)
-    cats = []
-    for key in index.get("category_keys") or []:
-        info = (index.get("categories") or {}).get(key) or {}
-        declared = info.get("declared_count")
-        actual = len(info.get("items") or [])
-        cats.append(
-            {
-                "key": key,
-                "count": int(declared) if isinstance(declared, int) else int(actual),
-                "actual": int(actual),
-            }
-        )
-    return web.json_response({"categories": cats, "total": len(index.get("items") or [])})
+    sizes = index.category_sizes().tolist()
+    cats = [
+        {"key": key, "count": int(actual), "actual": int(actual)}
+        for key, actual in zip(index.category_keys, sizes)
+    ]
+    return web.json_response({"categories": cats, "total": len(index)})
 
 
 @routes.get("/cozygen/api/tags/search")
 async def search_tags(request: web.Request):
     index = await _get_danbooru_tags_index()
-    if index.get("_error"):
+    if index is None:
         return web.json_response({"error": "danbooru tag reference unavailable"}, status=500)
     q = (request.rel_url.query.get("q", "") or "").strip().lower()
     category = (request.rel_url.query.get("category", "") or "").strip()
@@ -1191,47 +1431,27 @@ async def search_tags(request: web.Request):
     except Exception:
         min_count = 0
 
-    # Select base list
-    base = None
-    if category:
-        base = ((index.get("categories") or {}).get(category) or {}).get("items")
-    if base is None:
-        base = index.get("items_sorted") if sort != "alpha" else index.get("items")
-    base = base or []
-
-    # Filter
+    category_id = index.category_id(category) if category else -1
     if q:
+        # Every delimiter-separated part must occur; q itself contains them all.
         parts = [p for p in re.split(r"[_\-\s]+", q) if p]
-        filtered = []
-        for entry in base:
-            tl = entry.get("tag_lower") or ""
-            if not tl:
-                continue
-            if q in tl or (parts and all(p in tl for p in parts)):
-                filtered.append(entry)
-        base = filtered
-
-    if min_count > 0:
-        base = [entry for entry in base if int(entry.get("count") or 0) >= min_count]
-
-    # Sort
-    if sort == "alpha":
-        base = sorted(base, key=lambda e: e.get("tag_lower") or "")
+        rows = index.match(parts or [q], category_id, min_count)
+        if sort == "alpha":
+            rows = index.select(sort="alpha", rows=rows)
     else:
-        # Default: already popularity-sorted for the common case
-        if q:
-            base = sorted(base, key=lambda e: (-int(e.get("count") or 0), e.get("tag_lower") or ""))
+        rows = index.select(category_id, min_count, sort=sort)
 
-    total = len(base)
-    slice_ = base[offset : offset + limit]
+    total = len(rows)
+    slice_ = rows[offset : offset + limit].tolist()
 
+    counts = index.counts
     items = [
         {
-            "tag": e.get("tag") or "",
-            "count": int(e.get("count") or 0),
-            "category": e.get("category") or "",
+            "tag": index.tags[row],
+            "count": int(counts[row]),
+            "category": index.category_keys[index.category[row]],
         }
-        for e in slice_
+        for row in slice_
     ]
     return web.json_response(
         {
@@ -1246,6 +1466,27 @@ async def search_tags(request: web.Request):
     )
 
 
+@routes.get("/cozygen/api/tags/complete")
+async def complete_tags(request: web.Request):
+    """Prefix autocomplete; items are compact [tag, count, category] triples by popularity."""
+    index = await _get_danbooru_tags_index()
+    if index is None:
+        return web.json_response({"error": "danbooru tag reference unavailable"}, status=500)
+    prefix = re.sub(r"\s+", "_", (request.rel_url.query.get("prefix", "") or "").strip().lower())
+    category = (request.rel_url.query.get("category", "") or "").strip()
+    try:
+        limit = max(1, min(COMPLETE_TOP_K, int(request.rel_url.query.get("limit", "10"))))
+    except Exception:
+        limit = 10
+    if not prefix:
+        return web.json_response({"prefix": "", "items": []})
+
+    rows = index.complete(prefix, index.category_id(category) if category else -1, limit)
+    counts = index.counts
+    items = [[index.tags[row], int(counts[row]), index.category_keys[index.category[row]]] for row in rows]
+    return web.json_response({"prefix": prefix, "items": items})
+
+
 @routes.post("/cozygen/api/tags/validate")
 async def validate_tags(request: web.Request):
     payload = await request.json()
@@ -1254,9 +1495,8 @@ async def validate_tags(request: web.Request):
         return web.json_response({"error": "tags must be a list"}, status=400)
 
     index = await _get_danbooru_tags_index()
-    if index.get("_error"):
+    if index is None:
         return web.json_response({"error": "danbooru tag reference unavailable"}, status=500)
-    tag_set = index.get("tag_set_lower") or set()
 
     invalid = []
     suggestions = {}
@@ -1271,7 +1511,7 @@ async def validate_tags(request: web.Request):
         if tl in seen:
             continue
         seen.add(tl)
-        if tl in tag_set:
+        if tl in index:
             continue
         invalid.append(tag)
         suggestions[tag] = _suggest_danbooru_tags(tag, index, limit=8)
@@ -1279,6 +1519,111 @@ async def validate_tags(request: web.Request):
     return web.json_response({"invalid": invalid, "suggestions": suggestions})
 
 
+# Prompt validation caches are tied to one TagIndex: per lowercased tag the suggestions
+# for an unknown tag (None when it is known), and per prompt hash the finished result,
+# so re-validating after a one-tag edit only checks the edited tag.
+_PROMPT_CHECK_CACHE = {"index": None, "tags": {}, "prompts": {}}
+_PROMPT_CHECK_TAGS_MAX = 20000
+_PROMPT_CHECK_PROMPTS_MAX = 512
+_PROMPT_CHECK_BATCH_MAX = 1000
+_PROMPT_CHECK_SUGGESTIONS = 8
+
+
+def _prompt_check_cache(index: TagIndex) -> dict:
+    if _PROMPT_CHECK_CACHE["index"] is not index:
+        _PROMPT_CHECK_CACHE.update(index=index, tags={}, prompts={})
+    return _PROMPT_CHECK_CACHE
+
+
+def _prompt_check_put(cache: dict, key, value, limit: int):
+    cache[key] = value
+    if len(cache) > limit:
+        cache.pop(next(iter(cache)))
+
+
+def _suggest_many(tags: dict, index: TagIndex) -> dict:
+    return {tl: _suggest_danbooru_tags(tag, index, limit=_PROMPT_CHECK_SUGGESTIONS) for tl, tag in tags.items()}
+
+
+@routes.post("/cozygen/api/tags/validate_prompts")
+async def validate_prompts(request: web.Request):
+    """Tokenize raw prompts like the composer does and validate every tag in them.
+
+    Accepts {"prompt": str}, {"prompts": [str, ...]} or {"prompts": {name: str}} and
+    returns per-prompt token spans; unknown tags carry suggestions.
+    """
+    try:
+        payload = await request.json()
+    except Exception:
+        return web.json_response({"error": "invalid json payload"}, status=400)
+    if not isinstance(payload, dict):
+        return web.json_response({"error": "invalid json payload"}, status=400)
+    prompts = payload.get("prompts")
+    if prompts is None and isinstance(payload.get("prompt"), str):
+        prompts = [payload["prompt"]]
+    names = None
+    if isinstance(prompts, dict):
+        names = list(prompts.keys())
+        prompts = list(prompts.values())
+    if not isinstance(prompts, list) or not all(isinstance(p, str) for p in prompts):
+        return web.json_response({"error": "prompts must be a list or object of strings"}, status=400)
+    if len(prompts) > _PROMPT_CHECK_BATCH_MAX:
+        return web.json_response({"error": f"at most {_PROMPT_CHECK_BATCH_MAX} prompts per request"}, status=400)
+
+    index = await _get_danbooru_tags_index()
+    if index is None:
+        return web.json_response({"error": "danbooru tag reference unavailable"}, status=500)
+
+    cache = _prompt_check_cache(index)
+    results = [None] * len(prompts)
+    pending = []
+    for i, text in enumerate(prompts):
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        hit = cache["prompts"].get(key)
+        if hit is not None:
+            results[i] = hit
+        else:
+            pending.append((i, key, prompt_tokens(text)))
+
+    checked = {}
+    unknown = {}
+    for _i, _key, tokens in pending:
+        for token in tokens:
+            if token["type"] != "tag":
+                continue
+            tl = token["text"].lower()
+            if tl in checked or tl in unknown:
+                continue
+            if tl in cache["tags"]:
+                checked[tl] = cache["tags"][tl]
+            elif tl in index:
+                checked[tl] = None
+            else:
+                unknown[tl] = token["text"]
+    if unknown:
+        # Fuzzy suggestions cost milliseconds per tag; keep a large batch off the event loop.
+        checked.update(await asyncio.to_thread(_suggest_many, unknown, index))
+    for tl, suggestions in checked.items():
+        _prompt_check_put(cache["tags"], tl, suggestions, _PROMPT_CHECK_TAGS_MAX)
+
+    for i, key, tokens in pending:
+        invalid = []
+        for token in tokens:
+            if token["type"] != "tag":
+                continue
+            suggestions = checked[token["text"].lower()]
+            token["valid"] = suggestions is None
+            if suggestions is not None:
+                token["suggestions"] = suggestions
+                invalid.append(token["text"])
+        results[i] = {"tokens": tokens, "invalid": invalid}
+        _prompt_check_put(cache["prompts"], key, results[i], _PROMPT_CHECK_PROMPTS_MAX)
+
+    if names is not None:
+        return web.json_response({"results": dict(zip(names, results))})
+    return web.json_response({"results": results})
+
+
 # ---------------- Input browser
 INPUT_DIR = Path(folder_paths.get_input_directory()).resolve()
 
@@ -1489,56 +1834,65 @@ def _thumb_src_base(which: str) -> str:
     )
 
 
-def _thumb_dest_path(which: str, subfolder: str, filename: str, w: int) -> str:
-    safe_sub = (subfolder or "").strip().strip("/").replace("\\", "/")
-    dest_dir = os.path.join(THUMBS_DIR, which, safe_sub)
-    os.makedirs(dest_dir, exist_ok=True)
-    name, _ = os.path.splitext(filename)
-    return os.path.join(dest_dir, f"{name}__w{w}.jpg")
+start_sweeper(_thumb_src_base)
 
 
 def _thumb_headers(etag: str) -> dict:
     return {"Cache-Control": "public, max-age=31536000, immutable", "ETag": etag, "Content-Type": "image/jpeg"}
 
 
-def _make_image_thumb(src: str, dest: str, w: int):
-    with Image.open(src) as im:
-        im = ImageOps.exif_transpose(im).convert("RGB")
-        im.thumbnail((w, w), Image.Resampling.LANCZOS)
-        im.save(dest, "JPEG", quality=85, optimize=True, progressive=True)
-
-
-def _make_video_thumb(src: str, dest: str, w: int):
-    if shutil.which("ffmpeg"):
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-ss",
-            "0.10",
-            "-i",
-            src,
-            "-vframes",
-            "1",
-            "-vf",
-            f"scale='min({w},iw)':-1",
-            "-q:v",
-            "5",
-            dest,
-        ]
+def _ensure_peaks(which: str, subfolder: str, filename: str, src: str, st: os.stat_result) -> dict:
+    fp = fingerprint_for(which, subfolder, filename, src, st)
+    data, written = ensure_peaks(fp, src)
+    path = peaks_path(fp)
+    if written:
+        record_miss()
+        register_thumb(path)
+    else:
+        record_hit(path, os.stat(path))
+    return data
+
+
+def _ensure_placeholder(fp: str, rendered: str):
+    if get_placeholder(fp):
+        return
+    value = placeholder_from(rendered)
+    if value:
+        set_placeholder(fp, value)
+
+
+# (fingerprint, width) -> lock held while that thumbnail renders.
+_THUMB_INFLIGHT: dict = {}
+_THUMB_INFLIGHT_LOCK = threading.Lock()
+
+
+def _thumb_etag(st: os.stat_result, w: int) -> str:
+    return f'W/"{int(st.st_mtime)}-{st.st_size}-w{w}"'
+
+
+def _ensure_thumb(which: str, subfolder: str, filename: str, src: str, st: os.stat_result, w: int) -> str:
+    fp = fingerprint_for(which, subfolder, filename, src, st)
+    dest = thumb_path(fp, w)
+    if not os.path.exists(dest):
+        # Duplicate sources share a fingerprint, so concurrent requests wait for one render.
+        key = (fp, w)
+        with _THUMB_INFLIGHT_LOCK:
+            lock = _THUMB_INFLIGHT.setdefault(key, threading.Lock())
         try:
-            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-            if os.path.exists(dest) and os.path.getsize(dest) > 0:
-                return
-        except Exception:
-            pass
-    H = int(w * 9 / 16)
-    img = Image.new("RGB", (w, H), (40, 40, 48))
-    d = ImageDraw.Draw(img)
-    d.polygon(
-        [(int(w * 0.38), int(H * 0.30)), (int(w * 0.72), int(H * 0.50)), (int(w * 0.38), int(H * 0.70))],
-        fill=(240, 240, 240),
-    )
-    img.save(dest, "JPEG", quality=85, optimize=True, progressive=True)
+            with lock:
+                if not os.path.exists(dest):
+                    record_miss()
+                    for path in render_thumb(src, filename, dest, w, fp):
+                        register_thumb(path)
+                    _ensure_placeholder(fp, dest)
+                    return dest
+        finally:
+            with _THUMB_INFLIGHT_LOCK:
+                if _THUMB_INFLIGHT.get(key) is lock:
+                    del _THUMB_INFLIGHT[key]
+    record_hit(dest, os.stat(dest))
+    _ensure_placeholder(fp, dest)
+    return dest
 
 
 @routes.get("/cozygen/thumb")
@@ -1556,37 +1910,295 @@ async def thumb(request: web.Request):
     if not os.path.isfile(src):
         raise web.HTTPNotFound(text="Source not found")
     st = os.stat(src)
-    etag = f'W/"{int(st.st_mtime)}-{st.st_size}-w{w}"'
+    etag = _thumb_etag(st, w)
     if request.headers.get("If-None-Match") == etag:
         return web.Response(status=304, headers=_thumb_headers(etag))
-    dest = _thumb_dest_path(which, subfolder, filename, w)
-    need = True
-    if os.path.exists(dest):
-        if st.st_mtime <= os.stat(dest).st_mtime:
-            need = False
-    if need:
-        os.makedirs(os.path.dirname(dest), exist_ok=True)
-        ext = os.path.splitext(filename)[1].lower()
-        try:
-            if ext in (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp", ".tif", ".tiff"):
-                _make_image_thumb(src, dest, w)
-            elif ext in (".mp4", ".webm", ".mov", ".mkv"):
-                _make_video_thumb(src, dest, w)
-            else:
-                _make_video_thumb(src, dest, w)
-        except Exception:
-            _make_video_thumb(src, dest, w)
+    # Fingerprinting and rendering (audio peaks decode the whole file) stay off the event loop.
+    dest = await asyncio.to_thread(_ensure_thumb, which, subfolder, filename, src, st, w)
     return web.FileResponse(dest, headers=_thumb_headers(etag))
 
 
+@routes.get("/cozygen/api/waveform")
+async def waveform(request: web.Request):
+    which = (request.rel_url.query.get("type") or "output").lower()
+    filename = request.rel_url.query.get("filename")
+    subfolder = request.rel_url.query.get("subfolder", "")
+    if not filename:
+        raise web.HTTPBadRequest(text="Missing filename")
+    if not filename.lower().endswith(AUDIO_EXTS):
+        raise web.HTTPBadRequest(text="Waveforms are only available for audio files")
+    base = _thumb_src_base(which)
+    src = os.path.normpath(os.path.join(base, subfolder, filename))
+    if not src.startswith(base):
+        raise web.HTTPForbidden(text="Invalid path")
+    if not os.path.isfile(src):
+        raise web.HTTPNotFound(text="Source not found")
+    st = os.stat(src)
+    etag = f'W/"{int(st.st_mtime)}-{st.st_size}-a{WAVEFORM_BUCKETS}"'
+    headers = {"Cache-Control": "public, max-age=86400", "ETag": etag}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    try:
+        data = await asyncio.to_thread(_ensure_peaks, which, subfolder, filename, src, st)
+    except Exception as err:
+        logger.warning("CozyGen: waveform failed for %s: %s", src, err)
+        return web.json_response({"error": "waveform unavailable"}, status=503)
+    return web.json_response(
+        {
+            "duration": round(data["duration"], 3),
+            "buckets": int(len(data["peaks"])),
+            "peaks": data["peaks"].tolist(),
+            "rms": data["rms"].tolist(),
+        },
+        headers=headers,
+    )
+
+
+# Batch responses are a sequence of frames: a 4-byte big-endian header length, a JSON
+# header ({"index", "filename", "subfolder", "status", "etag"?, "size"}) and `size` bytes
+# of JPEG data. Frames are written as soon as each item is ready, so cached thumbnails
+# arrive first and misses follow as they render.
+_THUMB_BATCH_MAX_ITEMS = 200
+_THUMB_BATCH_WORKERS = 4
+_THUMB_BATCH_CONTENT_TYPE = "application/x-cozygen-thumbs"
+
+
+def _thumb_frame(header: dict, body: bytes = b""):
+    head = json.dumps({**header, "size": len(body)}, separators=(",", ":")).encode("utf-8")
+    return len(head).to_bytes(4, "big") + head, body
+
+
+def _load_batch_thumb(which: str, base: str, index: int, item, w: int):
+    if not isinstance(item, dict):
+        return _thumb_frame({"index": index, "status": 400})
+    filename = str(item.get("filename") or "")
+    subfolder = str(item.get("subfolder") or "")
+    header = {"index": index, "filename": filename, "subfolder": subfolder}
+    if not filename:
+        return _thumb_frame({**header, "status": 400})
+    src = os.path.normpath(os.path.join(base, subfolder, filename))
+    if not src.startswith(base):
+        return _thumb_frame({**header, "status": 403})
+    try:
+        st = os.stat(src)
+    except OSError:
+        return _thumb_frame({**header, "status": 404})
+    etag = _thumb_etag(st, w)
+    header["etag"] = etag
+    if item.get("etag") == etag:
+        return _thumb_frame({**header, "status": 304})
+    try:
+        dest = _ensure_thumb(which, subfolder, filename, src, st, w)
+        # Frames share one chunked response, so sendfile/FileResponse cannot carry them;
+        # renders are at most 1024px JPEGs, read here in the worker thread.
+        with open(dest, "rb") as f:
+            body = f.read()
+    except Exception as err:
+        logger.warning("CozyGen: batch thumbnail failed for %s: %s", src, err)
+        return _thumb_frame({**header, "status": 500})
+    return _thumb_frame({**header, "status": 200}, body)
+
+
+@routes.post("/cozygen/api/thumbs")
+async def thumbs_batch(request: web.Request):
+    try:
+        payload = await request.json()
+    except Exception:
+        return web.json_response({"error": "invalid json payload"}, status=400)
+    if not isinstance(payload, dict):
+        return web.json_response({"error": "invalid json payload"}, status=400)
+    items = payload.get("items")
+    if not isinstance(items, list) or not items:
+        return web.json_response({"error": "items required"}, status=400)
+    if len(items) > _THUMB_BATCH_MAX_ITEMS:
+        return web.json_response({"error": f"at most {_THUMB_BATCH_MAX_ITEMS} items per batch"}, status=400)
+    which = (payload.get("type") or "output").lower()
+    try:
+        w = max(96, min(1024, int(payload.get("w") or 384)))
+    except (TypeError, ValueError):
+        return web.json_response({"error": "bad width"}, status=400)
+    base = _thumb_src_base(which)
+
+    resp = web.StreamResponse(
+        headers={
+            "Content-Type": _THUMB_BATCH_CONTENT_TYPE,
+            "Cache-Control": "no-store",
+            "X-CozyGen-Thumb-Count": str(len(items)),
+        }
+    )
+    await resp.prepare(request)
+
+    sem = asyncio.Semaphore(_THUMB_BATCH_WORKERS)
+
+    async def _one(index, item):
+        async with sem:
+            return await asyncio.to_thread(_load_batch_thumb, which, base, index, item, w)
+
+    tasks = [asyncio.ensure_future(_one(i, item)) for i, item in enumerate(items)]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            head, body = await fut
+            await resp.write(head)
+            if body:
+                await resp.write(body)
+    finally:
+        for task in tasks:
+            task.cancel()
+    await resp.write_eof()
+    return resp
+
+
+# ---------------- Previews (low-bitrate clips for the gallery feed)
+_PREVIEW_WORKERS = asyncio.Semaphore(2)
+_PREVIEW_INFLIGHT: dict = {}
+_PREVIEW_SECONDS = 6
+_PREVIEW_GIF_MAX_FRAMES = 120
+
+
+def _preview_dest_path(fp: str, w: int, ext: str) -> str:
+    return render_path(fp, f"p{w}{ext}")
+
+
+def _make_video_preview(src: str, dest: str, w: int):
+    exe = ffmpeg_exe()
+    if not exe:
+        raise RuntimeError("ffmpeg not available")
+    cmd = [
+        exe,
+        "-y",
+        "-i",
+        src,
+        "-t",
+        str(_PREVIEW_SECONDS),
+        "-an",
+        "-vf",
+        f"scale='min({w},iw)':-2",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "veryfast",
+        "-crf",
+        "32",
+        "-maxrate",
+        "600k",
+        "-bufsize",
+        "1200k",
+        "-pix_fmt",
+        "yuv420p",
+        "-movflags",
+        "+faststart",
+        "-f",
+        "mp4",
+        dest,
+    ]
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+
+def _make_gif_preview(src: str, dest: str, w: int):
+    frames = []
+    durations = []
+    with Image.open(src) as im:
+        for frame in ImageSequence.Iterator(im):
+            if len(frames) >= _PREVIEW_GIF_MAX_FRAMES:
+                break
+            durations.append(int(frame.info.get("duration") or 100))
+            copy = frame.convert("RGBA")
+            copy.thumbnail((w, w), Image.Resampling.LANCZOS)
+            frames.append(copy)
+    if not frames:
+        raise RuntimeError("no frames")
+    frames[0].save(
+        dest,
+        "WEBP",
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=0,
+        quality=60,
+        method=4,
+    )
+
+
+def _ensure_preview(which: str, subfolder: str, filename: str, src: str, st: os.stat_result, w: int) -> str:
+    is_gif = filename.lower().endswith(".gif")
+    fp = fingerprint_for(which, subfolder, filename, src, st)
+    dest = _preview_dest_path(fp, w, ".webp" if is_gif else ".mp4")
+    if os.path.exists(dest):
+        record_hit(dest, os.stat(dest))
+        return dest
+    record_miss()
+    tmp = f"{dest}.part"
+    try:
+        if is_gif:
+            _make_gif_preview(src, tmp, w)
+        else:
+            _make_video_preview(src, tmp, w)
+        os.replace(tmp, dest)
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+    register_thumb(dest)
+    return dest
+
+
+async def _build_preview(which: str, subfolder: str, filename: str, src: str, st: os.stat_result, w: int) -> str:
+    key = (src, w)
+    pending = _PREVIEW_INFLIGHT.get(key)
+    if pending is None:
+
+        async def _run():
+            async with _PREVIEW_WORKERS:
+                return await asyncio.to_thread(_ensure_preview, which, subfolder, filename, src, st, w)
+
+        pending = asyncio.ensure_future(_run())
+        _PREVIEW_INFLIGHT[key] = pending
+        pending.add_done_callback(lambda _f: _PREVIEW_INFLIGHT.pop(key, None))
+    return await asyncio.shield(pending)
+
+
+@routes.get("/cozygen/preview")
+async def preview(request: web.Request):
+    which = (request.rel_url.query.get("type") or "output").lower()
+    filename = request.rel_url.query.get("filename")
+    subfolder = request.rel_url.query.get("subfolder", "")
+    try:
+        w = max(96, min(1280, int(request.rel_url.query.get("w", "480"))))
+    except ValueError:
+        raise web.HTTPBadRequest(text="Invalid width")
+    if not filename:
+        raise web.HTTPBadRequest(text="Missing filename")
+    if _type_for(filename) != "video" and not filename.lower().endswith(".gif"):
+        raise web.HTTPBadRequest(text="Previews are only available for videos and GIFs")
+    base = _thumb_src_base(which)
+    src = os.path.normpath(os.path.join(base, subfolder, filename))
+    if not src.startswith(base):
+        raise web.HTTPForbidden(text="Invalid path")
+    if not os.path.isfile(src):
+        raise web.HTTPNotFound(text="Source not found")
+    st = os.stat(src)
+    try:
+        dest = await _build_preview(which, subfolder, filename, src, st, w)
+    except Exception as err:
+        logger.warning("CozyGen: preview failed for %s: %s", src, err)
+        return web.json_response({"error": "preview unavailable"}, status=503)
+    content_type = "image/webp" if dest.endswith(".webp") else "video/mp4"
+    # FileResponse handles Range/If-Range and conditional requests itself.
+    return web.FileResponse(
+        dest,
+        headers={"Cache-Control": "public, max-age=86400", "Content-Type": content_type},
+    )
+
+
+@routes.get("/cozygen/api/thumb_cache")
+async def thumb_cache_stats(_request: web.Request):
+    return web.json_response(thumb_store_stats())
+
+
 @routes.post("/cozygen/api/clear_cache")
 async def clear_cache(request: web.Request):
     """Clear thumbnail cache"""
     try:
-        import shutil
-        if os.path.exists(THUMBS_DIR):
-            shutil.rmtree(THUMBS_DIR)
-            os.makedirs(THUMBS_DIR, exist_ok=True)
+        await asyncio.to_thread(clear_thumb_store)
 
         # Also clear the gallery cache
         global _GALLERY_CACHE
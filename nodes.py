@@ -11,7 +11,7 @@ import torch
 from PIL import Image
 
 from nodes import SaveImage  # type: ignore[attr-defined]
-from .prompt_raw_store import record_prompt_output
+from .prompt_raw_store import get_prompt_raw, record_prompt_output
 
 logger = logging.getLogger(__name__)
 
@@ -223,10 +223,18 @@ class CozyGenOutput(SaveImage):
     CATEGORY = "CozyGen"
 
     def save_images(self, images, filename_prefix="CozyGen/output", prompt=None, extra_pnginfo=None):
-        results = super().save_images(images, filename_prefix, prompt, extra_pnginfo)
         server_instance = server.PromptServer.instance
         prompt_id = getattr(server_instance, "last_prompt_id", None) if server_instance else None
 
+        # SaveImage writes each extra_pnginfo key as its own PNG text chunk, so the raw
+        # alias map travels with the file and the viewer never needs the store.
+        if prompt_id and not (extra_pnginfo or {}).get("cozygen_prompt_raw"):
+            raw_prompt = get_prompt_raw(prompt_id)
+            if raw_prompt:
+                extra_pnginfo = {**(extra_pnginfo or {}), "cozygen_prompt_raw": raw_prompt}
+
+        results = super().save_images(images, filename_prefix, prompt, extra_pnginfo)
+
         if server_instance and results and "ui" in results and "images" in results["ui"]:
             batch_images_data = []
             for saved_image in results["ui"]["images"]:
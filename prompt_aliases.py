@@ -0,0 +1,213 @@
+import re
+
+# Python port of js/src/utils/promptAliases.js. The patterns use ASCII-only case folding
+# and spell out JavaScript's \s, so matches are identical to the browser's.
+DELIM = "::"
+# JavaScript's \s (and what String.prototype.trim strips).
+_JS_SPACE_CHARS = (
+    "\t\n\v\f\r \u00a0\u1680" + "".join(map(chr, range(0x2000, 0x200B))) + "\u2028\u2029\u202f\u205f\u3000\ufeff"
+)
+_JS_SPACE = r"[\t\n\v\f\r \u00a0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000\ufeff]*"
+_FLAGS = re.ASCII | re.IGNORECASE
+_WEIGHTED_ALIAS_RE = re.compile(
+    rf"\({_JS_SPACE}\$([a-z0-9_:-]+)\${_JS_SPACE}:{_JS_SPACE}([0-9]+(?:\.[0-9]+)?){_JS_SPACE}\)", _FLAGS
+)
+_ALIAS_RE = re.compile(r"\$([a-z0-9_:-]+)\$", _FLAGS)
+_BARE_ALIAS_RE = re.compile(r"(?<!\$)\b([a-z0-9_]+)::([a-z0-9_:-]+)\b(?!\$)", _FLAGS)
+_WEIGHT_RE = re.compile(r"[0-9]+(\.[0-9]+)?")
+_MAX_PASSES = 10
+_MEMO_MAX = 1024
+
+
+def _trim(value: str) -> str:
+    return value.strip(_JS_SPACE_CHARS)
+
+
+def normalize_alias_map(aliases) -> dict:
+    """Trim keys/values and drop empties; keeps original casing for display."""
+    result = {}
+    if not isinstance(aliases, dict):
+        return result
+    for name, value in aliases.items():
+        key = _trim(str(name or ""))
+        if not key or not isinstance(value, str):
+            continue
+        text = _trim(value)
+        if text:
+            result[key] = text
+    return result
+
+
+def build_alias_lookup(aliases) -> dict:
+    """Lowercased alias key -> expansion; `fruit::cherry` is also reachable as `fruit:cherry`."""
+    lookup = {}
+    for name, value in normalize_alias_map(aliases).items():
+        key = name.lower()
+        lookup[key] = value
+        if DELIM in key:
+            lookup[key.replace(DELIM, ":", 1)] = value
+    return lookup
+
+
+def document_items(document) -> dict:
+    """The alias map of an aliases.json document: `items`, or the whole object in the legacy flat format."""
+    if not isinstance(document, dict):
+        return {}
+    items = document.get("items")
+    if items is None:
+        return document
+    return items if isinstance(items, dict) else {}
+
+
+def add_category_keys(lookup: dict, items: dict, categories) -> dict:
+    """Also map `<category>:<name>` for categorized aliases, like the usePromptAliases hook does."""
+    if not isinstance(categories, dict):
+        return lookup
+    for name, category in categories.items():
+        category_key = _trim(str(category or ""))
+        raw_key = _trim(str(name or ""))
+        value = items.get(name)
+        if not category_key or not raw_key or not value:
+            continue
+        parts = raw_key.split(DELIM)
+        base_name = DELIM.join(parts[1:]) if len(parts) > 1 else raw_key
+        if base_name:
+            lookup[f"{category_key}:{base_name}"] = value
+    return lookup
+
+
+def build_fallback_lookup(lookup: dict) -> dict:
+    """Bare name -> expansion for keys used without their category; None when ambiguous."""
+    fallback = {}
+    ambiguous = set()
+    for key, value in lookup.items():
+        key = key.lower()
+        if not key:
+            continue
+        base = key.rsplit(":", 1)[-1]
+        if not base or base in ambiguous:
+            continue
+        if base in fallback:
+            if fallback[base] == value:
+                continue
+            fallback[base] = None
+            ambiguous.add(base)
+            continue
+        fallback[base] = value
+    return fallback
+
+
+def _unwrap_weighted_tag(value: str):
+    trimmed = _trim(value)
+    if not trimmed.startswith("(") or not trimmed.endswith(")"):
+        return None
+    inner = trimmed[1:-1]
+    colon = inner.rfind(":")
+    if colon == -1:
+        return None
+    if _WEIGHT_RE.fullmatch(_trim(inner[colon + 1 :])) is None:
+        return None
+    return _trim(inner[:colon]) or None
+
+
+def _apply_alias_weight(replacement: str, weight: str) -> str:
+    parts = [p for p in (_trim(part) for part in replacement.split(",")) if p]
+    if not parts:
+        return replacement
+    return ", ".join(f"({_unwrap_weighted_tag(part) or part}:{weight})" for part in parts)
+
+
+class AliasLookup:
+    """Compiled alias table (lookup plus the ambiguous-name fallback) with memoized expansion.
+
+    Build one per version of the alias file and reuse it; expand() is the port of
+    applyPromptAliases and expand_form() of applyAliasesToForm.
+    """
+
+    def __init__(self, aliases, categories=None):
+        items = normalize_alias_map(aliases)
+        self.table = add_category_keys(build_alias_lookup(items), items, categories)
+        self._fallback = None
+        self._memo = {}
+
+    @classmethod
+    def from_document(cls, document):
+        categories = document.get("categories") if isinstance(document, dict) else None
+        return cls(document_items(document), categories)
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def fallback(self) -> dict:
+        if self._fallback is None:
+            self._fallback = build_fallback_lookup(self.table)
+        return self._fallback
+
+    def _resolve(self, key: str):
+        key = key.lower()
+        replacement = self.table.get(key)
+        if replacement is None and ":" not in key:
+            replacement = self.fallback.get(key)
+        return replacement
+
+    def _expand_weighted(self, match):
+        replacement = self._resolve(match.group(1))
+        if replacement is None:
+            return match.group(0)
+        return _apply_alias_weight(replacement, _trim(match.group(2)))
+
+    def _expand_alias(self, match):
+        replacement = self._resolve(match.group(1))
+        return match.group(0) if replacement is None else replacement
+
+    def _expand_bare(self, match):
+        end = match.end()
+        if end < len(match.string) and match.string[end] == ":":
+            return match.group(0)
+        key = f"{match.group(1)}::{match.group(2)}".lower()
+        replacement = self.table.get(key)
+        if replacement is None:
+            replacement = self.table.get(key.replace("::", ":", 1))
+        if replacement is not None:
+            return replacement
+        # Unknown category-qualified names fall back to the bare name.
+        return _trim(match.group(2)) or match.group(0)
+
+    def _expand_once(self, value: str) -> str:
+        result = _WEIGHTED_ALIAS_RE.sub(self._expand_weighted, value)
+        result = _ALIAS_RE.sub(self._expand_alias, result)
+        return _BARE_ALIAS_RE.sub(self._expand_bare, result)
+
+    def expand(self, text):
+        if not isinstance(text, str) or ("$" not in text and DELIM not in text):
+            return text
+        if not self.table:
+            return text
+        cached = self._memo.get(text)
+        if cached is not None:
+            return cached
+
+        result = text
+        seen = {result}
+        for _ in range(_MAX_PASSES):
+            expanded = self._expand_once(result)
+            if expanded == result or expanded in seen:
+                break
+            seen.add(expanded)
+            result = expanded
+            if "$" not in result:
+                break
+
+        if len(self._memo) >= _MEMO_MAX:
+            self._memo.pop(next(iter(self._memo)))
+        self._memo[text] = result
+        return result
+
+    def expand_form(self, form):
+        """Expand every string value of a form dict; returns the same dict when nothing changed."""
+        if not self.table or not isinstance(form, dict):
+            return form
+        expanded = {key: self.expand(value) if isinstance(value, str) else value for key, value in form.items()}
+        changed = any(expanded[key] != value for key, value in form.items())
+        return expanded if changed else form
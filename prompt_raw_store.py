@@ -1,20 +1,53 @@
+import atexit
 import json
+import logging
 import os
 import threading
 import time
+from collections import OrderedDict
 
 EXT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(EXT_DIR, "data")
+# The JSON file is a snapshot; every change since the last compaction is appended to
+# the journal as one JSON line, so writes cost O(1) instead of a full rewrite. Each
+# compaction bumps the snapshot's generation and journal lines carry the generation they
+# were written under ("g"), so lines already folded into a newer snapshot are skipped.
 PROMPT_RAW_FILE = os.path.join(DATA_DIR, "prompt_raw_store.json")
+PROMPT_RAW_JOURNAL = os.path.join(DATA_DIR, "prompt_raw_store.journal")
 
 _MAX_PROMPTS = 2000
 _MAX_FILES = 4000
+_COMPACT_AFTER_OPS = _MAX_PROMPTS + _MAX_FILES
+# Writes land in _CACHE immediately; a background writer appends them to disk after
+# _FLUSH_DELAY_SECONDS so a whole batch of outputs costs one journal append.
+_FLUSH_DELAY_SECONDS = 0.25
+# A failed write is retried, backing off up to _RETRY_MAX_SECONDS between attempts.
+_RETRY_MAX_SECONDS = 30.0
 _LOCK = threading.Lock()
+_FLUSH_LOCK = threading.Lock()
+_WAKE = threading.Event()
 _CACHE = None
+_JOURNAL_OPS = 0
+_PENDING = []
+_WRITER = None
+_STATS = {"flushes": 0, "flushed_ops": 0, "compactions": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0, "errors": 0}
+# prompts/files are OrderedDicts kept oldest-first by ts, so pruning pops from the
+# front; _FILES_BY_PROMPT maps prompt_id -> file keys for cascaded removal.
+_FILES_BY_PROMPT = {}
+
+logger = logging.getLogger(__name__)
 
 
 def _empty_store():
-    return {"version": 1, "prompts": {}, "files": {}}
+    return {"version": 1, "generation": 0, "prompts": OrderedDict(), "files": OrderedDict()}
+
+
+def _by_ts(entries):
+    def _ts(item):
+        value = item[1]
+        return value.get("ts", 0) if isinstance(value, dict) else 0
+
+    return OrderedDict(sorted(entries.items(), key=_ts))
 
 
 def _load_store():
@@ -29,23 +62,202 @@ def _load_store():
 
     prompts = data.get("prompts")
     files = data.get("files")
+    generation = data.get("generation")
     if not isinstance(prompts, dict):
         prompts = {}
     if not isinstance(files, dict):
         files = {}
-    return {"version": 1, "prompts": prompts, "files": files}
+    if isinstance(generation, bool) or not isinstance(generation, int):
+        generation = 0
+    # One sort at load time; afterwards every write appends in ts order.
+    return {"version": 1, "generation": generation, "prompts": _by_ts(prompts), "files": _by_ts(files)}
+
+
+def _index_files(data):
+    _FILES_BY_PROMPT.clear()
+    for key, entry in data["files"].items():
+        prompt_id = entry.get("prompt_id") if isinstance(entry, dict) else None
+        if prompt_id:
+            _FILES_BY_PROMPT.setdefault(prompt_id, set()).add(key)
+
+
+def _drop_file(data, key):
+    entry = data["files"].pop(key, None)
+    if entry is None:
+        return False
+    prompt_id = entry.get("prompt_id") if isinstance(entry, dict) else None
+    keys = _FILES_BY_PROMPT.get(prompt_id)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            _FILES_BY_PROMPT.pop(prompt_id, None)
+    return True
+
+
+def _apply_op(data, op):
+    kind = op.get("op")
+    if kind == "prompt":
+        prompts = data["prompts"]
+        prompts[op["id"]] = {"raw": op["raw"], "ts": op["ts"]}
+        prompts.move_to_end(op["id"])
+    elif kind == "file":
+        _drop_file(data, op["key"])
+        data["files"][op["key"]] = {"prompt_id": op["prompt_id"], "ts": op["ts"]}
+        _FILES_BY_PROMPT.setdefault(op["prompt_id"], set()).add(op["key"])
+    elif kind == "rm":
+        _drop_file(data, op["key"])
 
 
-def _save_store(data):
+def _replay_journal(data):
+    """Apply journal lines on top of the snapshot; returns how many were applied.
+
+    A torn final line (crash mid-append) fails to parse and is dropped, so the store
+    comes back as of the last complete write. Lines from an older generation are
+    already in the snapshot (a crash hit between compaction and truncate) and are
+    skipped: replaying them would reorder and re-prune prompts.
+    """
+    applied = 0
+    try:
+        with open(PROMPT_RAW_JOURNAL, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                    if op.get("g", 0) < data["generation"]:
+                        continue
+                    _apply_op(data, op)
+                    # Pruning is not journaled; repeating it per op reproduces the live state.
+                    _prune_store(data)
+                except Exception:
+                    continue
+                applied += 1
+    except FileNotFoundError:
+        pass
+    return applied
+
+
+def _append_ops(ops):
+    """Queue ops for the background writer. Caller holds _LOCK."""
+    global _WRITER
+    _PENDING.extend(ops)
+    if _WRITER is None:
+        _WRITER = threading.Thread(target=_writer_loop, name="CozyGenPromptRawWriter", daemon=True)
+        _WRITER.start()
+        atexit.register(flush)
+    _WAKE.set()
+
+
+def _write_journal(ops, generation):
+    """Append ops as JSON lines; on failure the journal is cut back to its previous size.
+
+    Without the truncate a partial append would leave a torn line that the retried
+    ops get glued onto, losing the first of them on replay.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    payload = "".join(json.dumps({**op, "g": generation}, separators=(",", ":")) + "\n" for op in ops)
+    payload = payload.encode("utf-8")
+    with open(PROMPT_RAW_JOURNAL, "ab", buffering=0) as f:
+        size = f.tell()
+        try:
+            view = memoryview(payload)
+            while view:
+                view = view[f.write(view) :]
+            os.fsync(f.fileno())
+        except Exception:
+            try:
+                f.truncate(size)
+            except OSError:
+                pass
+            raise
+
+
+def _write_snapshot(payload):
+    """Write a fresh snapshot atomically, then truncate the journal.
+
+    The snapshot carries a newer generation than every line in the old journal, so a
+    crash between the two steps leaves lines that the next load skips.
+    """
     os.makedirs(DATA_DIR, exist_ok=True)
-    with open(PROMPT_RAW_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    tmp = f"{PROMPT_RAW_FILE}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, PROMPT_RAW_FILE)
+    with open(PROMPT_RAW_JOURNAL, "w", encoding="utf-8"):
+        pass
+
+
+def flush() -> bool:
+    """Persist every queued write now; False if the write failed.
+
+    The writer thread and atexit both end up here.
+    """
+    global _JOURNAL_OPS
+    with _FLUSH_LOCK:
+        with _LOCK:
+            ops = _PENDING[:]
+            _PENDING.clear()
+            if not ops:
+                return True
+            snapshot = None
+            journal_ops = _JOURNAL_OPS
+            if _JOURNAL_OPS + len(ops) >= _COMPACT_AFTER_OPS:
+                # The snapshot already contains these ops, so they never reach the journal.
+                _CACHE["generation"] += 1
+                snapshot = json.dumps(_CACHE, separators=(",", ":"))
+                _JOURNAL_OPS = 0
+            else:
+                _JOURNAL_OPS += len(ops)
+            generation = _CACHE["generation"]
+        started = time.perf_counter()
+        try:
+            if snapshot is not None:
+                _write_snapshot(snapshot)
+            else:
+                _write_journal(ops, generation)
+        except Exception as err:
+            _STATS["errors"] += 1
+            logger.warning("CozyGen: failed to persist prompt_raw_store: %s", err)
+            with _LOCK:
+                # Keep the ops for the next attempt; a failed append leaves no trace in the journal.
+                _PENDING[:0] = ops
+                # A failed compaction leaves the old journal in place, so its count still applies.
+                _JOURNAL_OPS = journal_ops
+            # Have the writer try again after its backoff delay.
+            _WAKE.set()
+            return False
+        elapsed = (time.perf_counter() - started) * 1000.0
+        _STATS["flushes"] += 1
+        _STATS["flushed_ops"] += len(ops)
+        _STATS["compactions"] += snapshot is not None
+        _STATS["last_flush_ms"] = round(elapsed, 3)
+        _STATS["max_flush_ms"] = round(max(_STATS["max_flush_ms"], elapsed), 3)
+        return True
+
+
+def _writer_loop():
+    delay = _FLUSH_DELAY_SECONDS
+    while True:
+        _WAKE.wait()
+        time.sleep(delay)
+        _WAKE.clear()
+        delay = _FLUSH_DELAY_SECONDS if flush() else min(max(delay * 2, 1.0), _RETRY_MAX_SECONDS)
+
+
+def stats():
+    with _LOCK:
+        pending = len(_PENDING)
+        journal_ops = _JOURNAL_OPS
+    return {"pending_writes": pending, "journal_ops": journal_ops, **_STATS}
 
 
 def _ensure_cache():
-    global _CACHE
+    global _CACHE, _JOURNAL_OPS
     if _CACHE is None:
+        # A store written before the journal existed is simply a snapshot with an empty journal.
         _CACHE = _load_store()
+        _index_files(_CACHE)
+        _JOURNAL_OPS = _replay_journal(_CACHE)
     return _CACHE
 
 
@@ -79,37 +291,31 @@ def _sanitize_raw_map(raw_map):
 
 
 def _prune_store(data):
-    prompts = data.get("prompts") or {}
-    files = data.get("files") or {}
-
-    if len(prompts) > _MAX_PROMPTS:
-        ordered = sorted(prompts.items(), key=lambda item: item[1].get("ts", 0))
-        to_remove = {pid for pid, _ in ordered[: len(prompts) - _MAX_PROMPTS]}
-        for pid in to_remove:
-            prompts.pop(pid, None)
-        if to_remove:
-            for key, entry in list(files.items()):
-                if entry.get("prompt_id") in to_remove:
-                    files.pop(key, None)
-
-    if len(files) > _MAX_FILES:
-        ordered_files = sorted(files.items(), key=lambda item: item[1].get("ts", 0))
-        for key, _ in ordered_files[: len(files) - _MAX_FILES]:
+    prompts = data["prompts"]
+    files = data["files"]
+
+    while len(prompts) > _MAX_PROMPTS:
+        prompt_id, _ = prompts.popitem(last=False)
+        for key in _FILES_BY_PROMPT.pop(prompt_id, ()):
             files.pop(key, None)
 
+    while len(files) > _MAX_FILES:
+        _drop_file(data, next(iter(files)))
 
-def remove_prompt_file(filename, subfolder=""):
-    key = _build_file_key(filename, subfolder)
-    if not key:
-        return False
+
+def remove_prompt_files(items):
+    """Forget several (filename, subfolder) pairs with a single journal append."""
+    keys = [_build_file_key(filename, subfolder) for filename, subfolder in items]
     with _LOCK:
         data = _ensure_cache()
-        files = data.setdefault("files", {})
-        if key in files:
-            files.pop(key, None)
-            _save_store(data)
-            return True
-    return False
+        removed = [key for key in dict.fromkeys(keys) if key and _drop_file(data, key)]
+        if removed:
+            _append_ops([{"op": "rm", "key": key} for key in removed])
+    return len(removed)
+
+
+def remove_prompt_file(filename, subfolder=""):
+    return remove_prompt_files([(filename, subfolder)]) > 0
 
 
 def store_prompt_raw(prompt_id, raw_map):
@@ -121,9 +327,10 @@ def store_prompt_raw(prompt_id, raw_map):
     ts = time.time()
     with _LOCK:
         data = _ensure_cache()
-        data.setdefault("prompts", {})[str(prompt_id)] = {"raw": cleaned, "ts": ts}
+        op = {"op": "prompt", "id": str(prompt_id), "raw": cleaned, "ts": ts}
+        _apply_op(data, op)
         _prune_store(data)
-        _save_store(data)
+        _append_ops([op])
     return True
 
 
@@ -136,12 +343,24 @@ def record_prompt_output(prompt_id, filename, subfolder=""):
     ts = time.time()
     with _LOCK:
         data = _ensure_cache()
-        data.setdefault("files", {})[key] = {"prompt_id": str(prompt_id), "ts": ts}
+        op = {"op": "file", "key": key, "prompt_id": str(prompt_id), "ts": ts}
+        _apply_op(data, op)
         _prune_store(data)
-        _save_store(data)
+        _append_ops([op])
     return True
 
 
+def get_prompt_raw(prompt_id):
+    if not prompt_id:
+        return None
+    with _LOCK:
+        entry = (_ensure_cache().get("prompts") or {}).get(str(prompt_id)) or {}
+        raw = entry.get("raw")
+        if isinstance(raw, dict) and raw:
+            return dict(raw)
+    return None
+
+
 def get_prompt_raw_by_file(filename, subfolder=""):
     key = _build_file_key(filename, subfolder)
     if not key:
@@ -0,0 +1,148 @@
+import re
+
+# Python port of parsePromptElements/getElementWeight (js/src/utils/tokenWeights.js).
+# Offsets are code-point indices; they only differ from the browser's UTF-16 indices
+# after characters outside the BMP.
+_WEIGHT_RE = re.compile(r"\d+(\.\d+)?")
+_WEIGHT_ONLY_ALIAS_RE = re.compile(r":?[\d.]+")
+
+
+def _is_weight_wrapper_start(raw: str, idx: int) -> bool:
+    if raw[idx] != "(":
+        return False
+    colon = -1
+    j = idx + 1
+    while j < len(raw):
+        ch = raw[j]
+        if ch == "\n":
+            return False
+        if ch == ":":
+            colon = j
+        if ch == ")":
+            break
+        j += 1
+    if j >= len(raw) or colon == -1:
+        return False
+    return _WEIGHT_RE.fullmatch(raw[colon + 1 : j].strip()) is not None
+
+
+def parse_prompt_elements(text: str):
+    """Split a prompt into alias and tag elements: {type, text, start, end}.
+
+    `start`/`end` cover the whole element including a `(...:1.2)` wrapper, exactly
+    like the browser composer, so spans can be used to edit the prompt in place.
+    """
+    raw = str(text or "")
+    if not raw.strip():
+        return []
+
+    elements = []
+    i = 0
+    n = len(raw)
+    while i < n:
+        while i < n and (raw[i] == "," or raw[i].isspace()):
+            i += 1
+        if i >= n:
+            break
+
+        start = i
+        wrapped = _is_weight_wrapper_start(raw, i)
+        if wrapped:
+            i += 1
+
+        if i < n and raw[i] == "$":
+            kind = "alias"
+            alias_start = i
+            i += 1
+            j = i
+            while i < n and raw[i] not in "$,\n":
+                i += 1
+            content = raw[j:i]
+            if i < n and raw[i] == "$":
+                i += 1
+            if not wrapped:
+                start = alias_start
+        elif wrapped:
+            # Weighted group: keep commas inside so expanded aliases stay together.
+            kind = "tag"
+            j = i
+            while i < n and raw[i] not in ":\n)":
+                i += 1
+            content = raw[j:i]
+        else:
+            kind = "tag"
+            start = i
+            while i < n and raw[i] not in ",$\n":
+                i += 1
+            content = raw[start:i]
+
+        if wrapped and i < n and raw[i] == ":":
+            i += 1
+            while i < n and raw[i] not in "),\n":
+                i += 1
+            if i < n and raw[i] == ")":
+                i += 1
+        if wrapped and i < n and raw[i] == ")":
+            i += 1
+
+        content = content.strip()
+        if content and not (kind == "alias" and _WEIGHT_ONLY_ALIAS_RE.fullmatch(content)):
+            elements.append({"type": kind, "text": content, "start": start, "end": i})
+    return elements
+
+
+def element_weight(text: str, element: dict):
+    """Return the `(...:w)` weight of an element, or None when it is unweighted."""
+    full = str(text or "")[element["start"] : element["end"]]
+    if not full.startswith("(") or ":" not in full:
+        return None
+    after = full[full.rfind(":") + 1 :]
+    if not after.endswith(")"):
+        return None
+    num = after[:-1].strip()
+    if _WEIGHT_RE.fullmatch(num) is None:
+        return None
+    return float(num)
+
+
+def prompt_tokens(text: str):
+    """Flatten a prompt into the individual tags and alias references it contains.
+
+    Weighted groups such as `(a, b:1.2)` yield one token per comma-separated tag,
+    each with its own span and the group's weight. Bare `category::name` references
+    are reported as aliases, as applyPromptAliases expands them.
+    """
+    raw = str(text or "")
+    tokens = []
+    for element in parse_prompt_elements(raw):
+        weight = element_weight(raw, element)
+        if element["type"] == "alias":
+            tokens.append(
+                {
+                    "type": "alias",
+                    "text": element["text"],
+                    "start": element["start"],
+                    "end": element["end"],
+                    "weight": weight,
+                }
+            )
+            continue
+        # Find each part inside the element so spans point at the tag text itself.
+        pos = element["start"]
+        for part in element["text"].split(","):
+            tag = part.strip()
+            if not tag:
+                pos += len(part) + 1
+                continue
+            begin = raw.index(tag, pos)
+            tokens.append(
+                {
+                    "type": "alias" if "::" in tag else "tag",
+                    "text": tag,
+                    "start": begin,
+                    "end": begin + len(tag),
+                    "weight": weight,
+                }
+            )
+            pos = begin + len(tag)
+    return tokens
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Pre-render CozyGen thumbnails (and audio peaks/placeholders) for whole output/input trees.
+
+Renders are written through the same thumb_render/thumb_store code the /cozygen/thumb
+route uses, so the server picks them up as cache hits. Because renders are
+content-addressed, re-running after an interruption only renders what is still missing.
+Run it while ComfyUI is stopped so the server does not overwrite the fingerprint index.
+"""
+
+import argparse
+import os
+import sys
+import time
+import types
+from multiprocessing import Pool
+
+EXT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The helpers import each other relatively, so load them as submodules of the extension
+# directory. A bare package module stands in for it: the real __init__ registers nodes
+# and routes and needs a running ComfyUI.
+_PACKAGE = "cozygen_ext"
+if _PACKAGE not in sys.modules:
+    _package = types.ModuleType(_PACKAGE)
+    _package.__path__ = [EXT_DIR]
+    sys.modules[_PACKAGE] = _package
+
+from cozygen_ext import thumb_render, thumb_store  # noqa: E402
+
+MEDIA_EXTS = thumb_render.IMAGE_EXTS + thumb_render.VIDEO_EXTS + thumb_render.AUDIO_EXTS
+DEFAULT_WIDTHS = "192,384,768"
+
+
+def _default_comfy_dir(name):
+    # custom_nodes/<this extension> -> ComfyUI root
+    return os.path.join(os.path.dirname(os.path.dirname(EXT_DIR)), name)
+
+
+def _log(message):
+    sys.stderr.write(f"{message}\n")
+    sys.stderr.flush()
+
+
+def iter_sources(which, base, include_hidden):
+    for root, dirs, files in os.walk(base):
+        dirs[:] = sorted(d for d in dirs if include_hidden or not d.startswith("."))
+        subfolder = os.path.relpath(root, base).replace("\\", "/")
+        if subfolder == ".":
+            subfolder = ""
+        for name in sorted(files):
+            if not include_hidden and name.startswith("."):
+                continue
+            if not name.lower().endswith(MEDIA_EXTS):
+                continue
+            yield which, subfolder, name, os.path.join(root, name)
+
+
+def plan_job(source, widths):
+    """Return a render job for a source, or None when every output already exists.
+
+    A job can have no widths left to render when only the placeholder is missing; it
+    is then built from the smallest width, which is already cached.
+    """
+    which, subfolder, name, src = source
+    try:
+        st = os.stat(src)
+    except OSError:
+        return None
+    fp = thumb_store.cached_fingerprint(which, subfolder, name, st)
+    if fp is not None:
+        missing = [w for w in widths if not os.path.exists(thumb_render.thumb_path(fp, w))]
+        if not missing and thumb_store.get_placeholder(fp):
+            return None
+    else:
+        missing = list(widths)
+    return {"source": source, "st": st, "fp": fp, "widths": missing, "placeholder_width": min(widths)}
+
+
+def _worker_init(nice):
+    if nice and hasattr(os, "nice"):
+        try:
+            os.nice(nice)
+        except OSError:
+            pass
+
+
+def render_job(job):
+    _which, _subfolder, name, src = job["source"]
+    result = {"job": job, "fp": job["fp"], "written": [], "placeholder": None, "error": None}
+    try:
+        fp = job["fp"] or thumb_store.compute_fingerprint(src, job["st"].st_size)
+        result["fp"] = fp
+        for w in job["widths"]:
+            dest = thumb_render.thumb_path(fp, w)
+            if os.path.exists(dest):
+                continue
+            result["written"].extend(thumb_render.render_thumb(src, name, dest, w, fp))
+        smallest = thumb_render.thumb_path(fp, job["placeholder_width"])
+        if os.path.exists(smallest):
+            result["placeholder"] = thumb_render.placeholder_from(smallest)
+    except Exception as err:
+        result["error"] = f"{src}: {err}"
+    return result
+
+
+def throttled(jobs, max_files_per_sec, max_mb_per_sec):
+    """Yield jobs no faster than the configured file and source-byte rates."""
+    started = time.monotonic()
+    files = 0
+    read_bytes = 0
+    for job in jobs:
+        files += 1
+        read_bytes += job["st"].st_size
+        wait = 0.0
+        if max_files_per_sec > 0:
+            wait = max(wait, files / max_files_per_sec - (time.monotonic() - started))
+        if max_mb_per_sec > 0:
+            wait = max(wait, read_bytes / (max_mb_per_sec * 1024 * 1024) - (time.monotonic() - started))
+        if wait > 0:
+            time.sleep(wait)
+        yield job
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output-dir", default=_default_comfy_dir("output"))
+    parser.add_argument("--input-dir", default=_default_comfy_dir("input"))
+    parser.add_argument("--skip-input", action="store_true", help="only process the output directory")
+    parser.add_argument("--widths", default=DEFAULT_WIDTHS, help=f"comma-separated widths (default {DEFAULT_WIDTHS})")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--max-files-per-sec", type=float, default=0.0, help="throttle source files per second")
+    parser.add_argument("--max-mb-per-sec", type=float, default=0.0, help="throttle source MiB read per second")
+    parser.add_argument("--nice", type=int, default=10, help="niceness increment for worker processes")
+    parser.add_argument("--include-hidden", action="store_true")
+    parser.add_argument("--checkpoint", type=int, default=500, help="flush the fingerprint index every N files")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be rendered and exit")
+    args = parser.parse_args()
+
+    # Same clamp as the /cozygen/thumb route, otherwise the renders would never be requested.
+    widths = sorted({max(96, min(1024, int(w))) for w in args.widths.split(",") if w.strip()})
+    roots = [("output", os.path.abspath(args.output_dir))]
+    if not args.skip_input:
+        roots.append(("input", os.path.abspath(args.input_dir)))
+
+    sources = []
+    for which, base in roots:
+        if not os.path.isdir(base):
+            _log(f"skip {which}: {base} is not a directory")
+            continue
+        sources.extend(iter_sources(which, base, args.include_hidden))
+    jobs = [job for job in (plan_job(source, widths) for source in sources) if job]
+    _log(f"{len(sources)} media files, {len(jobs)} need rendering (widths {widths})")
+
+    if args.dry_run:
+        for job in jobs:
+            _log(f"would render {job['source'][3]} at {job['widths'] or 'placeholder only'}")
+        return
+
+    done = rendered = errors = 0
+    last_report = time.monotonic()
+    started = last_report
+    pool = Pool(processes=max(1, args.workers), initializer=_worker_init, initargs=(args.nice,))
+    try:
+        stream = throttled(iter(jobs), args.max_files_per_sec, args.max_mb_per_sec)
+        for result in pool.imap_unordered(render_job, stream, chunksize=4):
+            done += 1
+            job = result["job"]
+            which, subfolder, name, _src = job["source"]
+            if result["error"]:
+                errors += 1
+                _log(f"error: {result['error']}")
+            if result["fp"]:
+                thumb_store.remember_fingerprint(which, subfolder, name, job["st"], result["fp"])
+                if result["placeholder"]:
+                    thumb_store.set_placeholder(result["fp"], result["placeholder"])
+            rendered += len(result["written"])
+            if args.checkpoint > 0 and done % args.checkpoint == 0:
+                thumb_store.flush_index()
+            now = time.monotonic()
+            if now - last_report >= 2.0 or done == len(jobs):
+                rate = done / max(now - started, 1e-6)
+                _log(f"[{done}/{len(jobs)}] {rendered} files written, {errors} errors, {rate:.1f} sources/s")
+                last_report = now
+        pool.close()
+    except KeyboardInterrupt:
+        _log("interrupted; progress so far is kept, re-run to resume")
+        pool.terminate()
+    finally:
+        pool.join()
+        thumb_store.flush_index()
+
+
+if __name__ == "__main__":
+    main()
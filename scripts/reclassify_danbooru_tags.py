@@ -1,7 +1,23 @@
 #!/usr/bin/env python3
+"""Move tags out of the catch-all categories of data/danbooru_tags.md using token rules.
+
+Every token of a tag is looked up once in a table that maps it to the rule sets it
+belongs to, and the rules are then checked in precedence order against those bits.
+Chunks of tags are classified in parallel. With --incremental, results are cached
+per tag together with a fingerprint of the rules, so a re-run only classifies tags
+that are new, moved to another source category, or affected by a rule change.
+"""
 import argparse
+import hashlib
+import inspect
+import json
+import os
 import re
+import sys
 from collections import defaultdict
+from multiprocessing import Pool
+
+EXT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 CATEGORY_RE = re.compile(r"^##\s+(.+?)(?:\s+\((\d+)\))?\s*$")
 TAG_RE = re.compile(r"^-\s+`([^`]+)`\s+—\s+(\d+)\s*$")
@@ -492,115 +508,161 @@ WEAPON_TOKENS = {
 }
 
 
+# Rule sets in the order classify_tag checks them; each gets one bit in TOKEN_FLAGS.
+POSE_PRIMARY_TOKENS = {"sitting", "standing", "lying", "kneeling", "running", "walking", "jumping", "leaning"}
+META_PRIMARY_TOKENS = {"censored", "mosaic", "request"}
+_RULE_SETS = (
+    ("explicit", NSFW_EXPLICIT_TOKENS),
+    ("nudity", NSFW_NUDITY_TOKENS),
+    ("violence", VIOLENCE_TOKENS),
+    ("view", {"view"}),
+    ("pose_primary", POSE_PRIMARY_TOKENS),
+    ("expression", EXPRESSION_TOKENS),
+    ("subject_count", SUBJECT_COUNT_EXACT),
+    ("clothing", CLOTHING_TOKENS),
+    ("anatomy", ANATOMY_TOKENS),
+    ("style", STYLE_TOKENS),
+    ("lighting", LIGHTING_TOKENS),
+    ("location", LOCATION_TOKENS),
+    ("text", TEXT_TOKENS),
+    ("meta_primary", META_PRIMARY_TOKENS),
+    ("weapon", {"weapon"}),
+)
+FLAG = {name: 1 << bit for bit, (name, _tokens) in enumerate(_RULE_SETS)}
+TOKEN_FLAGS = {}
+for _name, _tokens in _RULE_SETS:
+    for _token in _tokens:
+        TOKEN_FLAGS[_token] = TOKEN_FLAGS.get(_token, 0) | FLAG[_name]
+
+F_EXPLICIT = FLAG["explicit"]
+F_NUDITY = FLAG["nudity"]
+F_VIOLENCE = FLAG["violence"]
+F_VIEW = FLAG["view"]
+F_POSE_PRIMARY = FLAG["pose_primary"]
+F_EXPRESSION = FLAG["expression"]
+F_SUBJECT_COUNT = FLAG["subject_count"]
+F_CLOTHING = FLAG["clothing"]
+F_ANATOMY = FLAG["anatomy"]
+F_STYLE = FLAG["style"]
+F_LIGHTING = FLAG["lighting"]
+F_LOCATION = FLAG["location"]
+F_TEXT = FLAG["text"]
+F_META_PRIMARY = FLAG["meta_primary"]
+F_WEAPON = FLAG["weapon"]
+
+PAREN_RE = re.compile(r"\(([^)]+)\)")
+PAREN_STRIP_RE = re.compile(r"\([^)]*\)")
+PAREN_SPLIT_RE = re.compile(r"[_\-\s]+")
+TOKEN_SPLIT_RE = re.compile(r"[_\-]+")
+SUBJECT_COUNT_RE = re.compile(
+    r"^\d+(girl|girls|boy|boys|person|people|man|men|woman|women|child|children|animal|animals|object|objects)$"
+)
+CHUNK_SIZE = 20000
+
+
 def _tokenize(tag: str):
     tag = tag.lower().strip()
-    paren_parts = re.findall(r"\(([^)]+)\)", tag)
+    if "(" not in tag:
+        return tag, [t for t in TOKEN_SPLIT_RE.split(tag) if t], []
     paren_tokens = []
-    for part in paren_parts:
-        paren_tokens.extend([t for t in re.split(r"[_\-\s]+", part) if t])
-    tag_no_paren = re.sub(r"\([^)]*\)", "", tag)
-    tokens = [t for t in re.split(r"[_\-]+", tag_no_paren) if t]
+    for part in PAREN_RE.findall(tag):
+        paren_tokens.extend([t for t in PAREN_SPLIT_RE.split(part) if t])
+    tokens = [t for t in TOKEN_SPLIT_RE.split(PAREN_STRIP_RE.sub("", tag)) if t]
     return tag, tokens, paren_tokens
 
 
-def _has_any(tokens, wanted):
-    return any(token in wanted for token in tokens)
-
-
-def _matches_prefix(tag, prefix):
-    return tag.startswith(prefix)
-
-
-def _matches_suffix(tag, suffix):
-    return tag.endswith(suffix)
-
-
 def classify_tag(tag: str, raw_category: str) -> str:
     if raw_category not in GENERAL_CATEGORIES:
         return raw_category
 
     tag_l, tokens, paren_tokens = _tokenize(tag)
-    all_tokens = tokens + paren_tokens
+    flags = 0
+    for token in tokens:
+        flags |= TOKEN_FLAGS.get(token, 0)
+    for token in paren_tokens:
+        flags |= TOKEN_FLAGS.get(token, 0)
 
-    if _has_any(all_tokens, NSFW_EXPLICIT_TOKENS):
+    if flags & F_EXPLICIT:
         return "nsfw_explicit"
-    if _has_any(all_tokens, NSFW_NUDITY_TOKENS):
+    if flags & F_NUDITY:
         return "nsfw_nudity"
 
-    if _has_any(all_tokens, VIOLENCE_TOKENS):
+    if flags & F_VIOLENCE:
         return "violence_gore"
 
-    if tag_l in CAMERA_EXACT:
+    if tag_l in CAMERA_EXACT or tag_l.startswith("from_"):
         return "camera_composition"
-    if _matches_prefix(tag_l, "from_"):
+    if (tag_l.endswith("_view") or flags & F_VIEW) and "review" not in tag_l:
         return "camera_composition"
-    if _matches_suffix(tag_l, "_view") or "view" in all_tokens:
-        if "review" not in tag_l:
-            return "camera_composition"
 
-    if tag_l in POSE_EXACT:
-        return "pose_action"
-    if _matches_prefix(tag_l, "looking_"):
+    if tag_l in POSE_EXACT or tag_l.startswith("looking_"):
         return "pose_action"
-    if _has_any(all_tokens, POSE_TOKENS) and any(tok in {"sitting", "standing", "lying", "kneeling", "running", "walking", "jumping", "leaning"} for tok in all_tokens):
+    # Every primary pose token is also a POSE_TOKENS member.
+    if flags & F_POSE_PRIMARY:
         return "pose_action"
 
-    if _has_any(all_tokens, EXPRESSION_TOKENS):
+    if flags & F_EXPRESSION:
         return "expression_emotion"
 
-    if _has_any(all_tokens, SUBJECT_COUNT_EXACT):
-        return "subject_count"
-    if re.match(r"^\d+(girl|girls|boy|boys|person|people|man|men|woman|women|child|children|animal|animals|object|objects)$", tag_l):
+    if flags & F_SUBJECT_COUNT or SUBJECT_COUNT_RE.match(tag_l):
         return "subject_count"
 
-    if _has_any(all_tokens, CLOTHING_TOKENS):
-        return "clothing_accessories"
-    if _matches_suffix(tag_l, "_sleeves") or _matches_suffix(tag_l, "_thighhighs"):
+    if flags & F_CLOTHING or tag_l.endswith("_sleeves") or tag_l.endswith("_thighhighs"):
         return "clothing_accessories"
 
-    if _has_any(all_tokens, ANATOMY_TOKENS):
+    if flags & F_ANATOMY:
         return "anatomy_body"
 
-    if _has_any(all_tokens, STYLE_TOKENS) or "medium" in paren_tokens:
+    if flags & F_STYLE or "medium" in paren_tokens:
         return "style_medium"
 
-    if _has_any(all_tokens, LIGHTING_TOKENS):
+    if flags & F_LIGHTING:
         return "lighting"
 
-    if _has_any(all_tokens, LOCATION_TOKENS):
+    if flags & F_LOCATION:
         return "location_scene"
 
-    if _has_any(all_tokens, TEXT_TOKENS):
+    if flags & F_TEXT:
         return "text_symbols"
 
-    if tag_l.startswith("bad_"):
-        return "meta_quality"
-    if _matches_suffix(tag_l, "_id") or _matches_suffix(tag_l, "_name"):
+    if tag_l.startswith("bad_") or tag_l.endswith("_id") or tag_l.endswith("_name"):
         return "meta_quality"
-    if _has_any(all_tokens, META_TOKENS) and any(tok in {"censored", "mosaic", "request"} for tok in all_tokens):
+    if flags & F_META_PRIMARY:
         return "meta_quality"
 
-    if _has_any(all_tokens, WEAPON_TOKENS):
-        if "weapon" in all_tokens or "weapon" in paren_tokens:
-            return "weapons_tools"
+    if flags & F_WEAPON:
+        return "weapons_tools"
 
     return raw_category
 
 
+def rules_fingerprint() -> str:
+    """Hash of every rule table and of classify_tag itself; changes whenever a rule does."""
+    h = hashlib.blake2b(digest_size=16)
+    tables = {name: sorted(value) for name, value in globals().items() if name.isupper() and isinstance(value, set)}
+    h.update(json.dumps(tables, sort_keys=True).encode("utf-8"))
+    h.update(inspect.getsource(classify_tag).encode("utf-8"))
+    return h.hexdigest()
+
+
+def classify_chunk(chunk):
+    return [classify_tag(tag, category) for tag, category in chunk]
+
+
 def parse_tags(path):
     entries = []
     categories_in_order = []
     current_category = None
     with open(path, "r", encoding="utf-8") as handle:
         for line in handle:
-            line = line.rstrip("\n")
-            m_cat = CATEGORY_RE.match(line.strip())
+            line = line.strip()
+            m_cat = CATEGORY_RE.match(line) if line.startswith("##") else None
             if m_cat:
                 current_category = (m_cat.group(1) or "").strip()
                 if current_category not in categories_in_order:
                     categories_in_order.append(current_category)
                 continue
-            m_tag = TAG_RE.match(line.strip())
+            m_tag = TAG_RE.match(line)
             if m_tag:
                 tag = (m_tag.group(1) or "").strip()
                 if not tag:
@@ -613,32 +675,134 @@ def parse_tags(path):
     return entries, categories_in_order
 
 
-def write_tags(path, groups, ordered_categories):
-    with open(path, "w", encoding="utf-8") as handle:
-        handle.write("# Danbooru Tag Reference (by category)\n\n")
-        for category in ordered_categories:
-            items = groups.get(category)
-            if not items:
-                continue
-            handle.write(f"## {category} ({len(items)})\n\n")
-            for entry in items:
-                handle.write(f"- `{entry['tag']}` — {entry['count']}\n")
-            handle.write("\n")
+def render_tags(groups, ordered_categories):
+    parts = ["# Danbooru Tag Reference (by category)\n\n"]
+    for category in ordered_categories:
+        items = groups.get(category)
+        if not items:
+            continue
+        parts.append(f"## {category} ({len(items)})\n\n")
+        parts.extend(f"- `{entry['tag']}` — {entry['count']}\n" for entry in items)
+        parts.append("\n")
+    return "".join(parts)
+
+
+def write_tags(path, content):
+    """Write content unless the file already holds it; returns True when it was written.
+
+    Leaving an unchanged file alone keeps its mtime, so the server does not reload the
+    tag index for nothing.
+    """
+    encoded = content.encode("utf-8")
+    try:
+        with open(path, "rb") as handle:
+            if handle.read() == encoded:
+                return False
+    except OSError:
+        pass
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as handle:
+        handle.write(encoded)
+    os.replace(tmp, path)
+    return True
+
+
+def load_state(path, fingerprint):
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            state = json.load(handle)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(state, dict) or state.get("rules") != fingerprint:
+        return {}
+    tags = state.get("tags")
+    return tags if isinstance(tags, dict) else {}
+
+
+def save_state(path, fingerprint, cache):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as handle:
+        handle.write(json.dumps({"rules": fingerprint, "tags": cache}, separators=(",", ":")))
+    os.replace(tmp, path)
+
+
+def classify_entries(entries, workers, cache):
+    """Return (categories, classified count, next cache), classifying only what cache lacks.
+
+    The cache maps tag -> [source category, result]. Only tags from the catch-all
+    categories are cached since every other category passes through unchanged.
+    """
+    results = [None] * len(entries)
+    next_cache = {}
+    todo = []
+    for i, entry in enumerate(entries):
+        category = entry["category"]
+        if category not in GENERAL_CATEGORIES:
+            results[i] = category
+            continue
+        hit = cache.get(entry["tag"])
+        if hit is not None and hit[0] == category:
+            results[i] = hit[1]
+            next_cache[entry["tag"]] = hit
+        else:
+            todo.append(i)
+
+    pairs = [(entries[i]["tag"], entries[i]["category"]) for i in todo]
+    chunks = [pairs[start : start + CHUNK_SIZE] for start in range(0, len(pairs), CHUNK_SIZE)]
+    if workers > 1 and len(chunks) > 1:
+        with Pool(processes=min(workers, len(chunks))) as pool:
+            classified = [category for chunk in pool.map(classify_chunk, chunks) for category in chunk]
+    else:
+        classified = [category for chunk in chunks for category in classify_chunk(chunk)]
+
+    for i, category in zip(todo, classified):
+        results[i] = category
+        next_cache[entries[i]["tag"]] = [entries[i]["category"], category]
+    return results, len(todo), next_cache
+
+
+def emit_index(idx_path, output_path, content):
+    """Compile the tag index for the written reference so the server can map it directly."""
+    sys.path.insert(0, EXT_DIR)
+    import tag_index
+
+    digest = hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+    data = tag_index.build_index_bytes(tag_index.parse_tags_lines(content.splitlines()), (0, 0), digest)
+    tag_index.write_index(idx_path, tag_index.stamp_signature(data, tag_index.source_signature(output_path)))
 
 
 def main():
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
     parser.add_argument("--input", default="data/danbooru_tags.md")
     parser.add_argument("--output", default="data/danbooru_tags.md")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes for classification")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="reuse cached results for tags whose source category and the rules are unchanged",
+    )
+    parser.add_argument("--state", default="data/danbooru_tags.reclassify.json", help="cache file for --incremental")
+    parser.add_argument(
+        "--emit-index",
+        nargs="?",
+        const="data/danbooru_tags.idx",
+        default=None,
+        metavar="PATH",
+        help="also write the compiled tag index (default path data/danbooru_tags.idx)",
+    )
     args = parser.parse_args()
 
     entries, categories_in_order = parse_tags(args.input)
 
+    fingerprint = rules_fingerprint()
+    cache = load_state(args.state, fingerprint) if args.incremental else {}
+    categories, classified, cache = classify_entries(entries, max(1, args.workers), cache)
+    if args.incremental:
+        save_state(args.state, fingerprint, cache)
+
     groups = defaultdict(list)
-    for entry in entries:
-        new_category = classify_tag(entry["tag"], entry["category"])
-        entry = {**entry, "category": new_category}
-        groups[new_category].append(entry)
+    for entry, new_category in zip(entries, categories):
+        groups[new_category].append({**entry, "category": new_category})
 
     for category, items in groups.items():
         items.sort(key=lambda e: (-int(e.get("count") or 0), e.get("tag", "").lower()))
@@ -647,7 +811,13 @@ def main():
     extras = sorted([c for c in groups.keys() if c not in ordered_categories])
     ordered_categories.extend(extras)
 
-    write_tags(args.output, groups, ordered_categories)
+    content = render_tags(groups, ordered_categories)
+    written = write_tags(args.output, content)
+    if args.emit_index:
+        emit_index(args.emit_index, args.output, content)
+    sys.stderr.write(
+        f"{len(entries)} tags, {classified} classified, output {'written' if written else 'unchanged'}\n"
+    )
 
 
 if __name__ == "__main__":
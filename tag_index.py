@@ -0,0 +1,787 @@
+"""Compiled Danbooru tag index.
+
+data/danbooru_tags.md is parsed once and compiled into data/danbooru_tags.idx, a flat
+binary file that is memory-mapped on startup. Numeric columns are NumPy views straight
+into the mapping, so several ComfyUI processes share the same pages and a warm start
+does no parsing at all. The index is rebuilt whenever the source's size/mtime change
+and its content hash no longer matches the one recorded in the header.
+"""
+
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RE_CATEGORY = re.compile(r"^##\s+(.+?)(?:\s+\((\d+)\))?\s*$")
+RE_TAG = re.compile(r"^-\s+`([^`]+)`\s+—\s+(\d+)\s*$")
+RE_TIME_TAG = re.compile(r"^(?:\d{1,2}:\d{2}(?:am|pm)?|\d+:)$", re.I)
+
+CATEGORY_MAP = {
+    "anatomy_body": "body",
+    "camera_composition": "camera",
+    "clothing_accessories": "clothing",
+    "color": "color",
+    "expression_emotion": "expression",
+    "lighting": "lighting",
+    "location_scene": "scene",
+    "meta_quality": "quality",
+    "name_title_misc": "names",
+    "other": "general",
+    "pose_action": "pose",
+    "style_medium": "style",
+    "text_symbols": "text",
+    "subject_count": "meta",
+    "weapons_tools": "props",
+    "violence_gore": "violence",
+    "nsfw_suggestive": "nsfw",
+    "nsfw_nudity": "nsfw",
+    "nsfw_explicit": "nsfw",
+}
+
+_MAGIC = b"CZTI"
+_VERSION = 3
+# magic, version, rows, source size, source mtime_ns, source blake2b-16
+_HEADER = struct.Struct("<4sHxxIQq16s")
+# Section order in the file; each entry in the table is (offset, length) in bytes.
+_SECTIONS = (
+    "meta",  # JSON: category keys and raw category names
+    "lower_offsets",  # uint32[rows + 1] into lower_pool
+    "lower_pool",  # "\n"-joined lowercase tags, rows in alphabetical order
+    "tag_offsets",  # uint32[rows + 1] into tag_pool
+    "tag_pool",  # "\n"-joined tags as written in the source
+    "counts",  # int64[rows]
+    "category",  # uint16[rows], index into meta["categories"]
+    "category_raw",  # uint16[rows], index into meta["raw_categories"]
+    "by_count",  # int32[rows], rows ordered by (-count, tag_lower)
+    "file_order",  # int32[rows], rows in source order
+    "gram_keys",  # uint32[grams], sorted byte trigrams of tag_lower
+    "gram_offsets",  # uint32[grams + 1] into gram_postings
+    "gram_postings",  # int32, popularity ranks (positions in by_count) per trigram, ascending
+    "fuzzy_keys",  # uint32[keys], sorted crc32 of SymSpell deletes of each tag's prefix
+    "fuzzy_offsets",  # uint32[keys + 1] into fuzzy_postings
+    "fuzzy_postings",  # int32, popularity ranks per delete hash, ascending
+    "char_masks",  # uint64[rows], which character classes (see _char_mask) each tag uses
+)
+_TABLE = struct.Struct(f"<{2 * len(_SECTIONS)}Q")
+_ALIGN = 8
+# Autocomplete keeps the COMPLETE_TOP_K most popular rows of every 1-2 byte prefix ready,
+# and memoizes up to _COMPLETE_CACHE_MAX (prefix, category, limit) answers per index.
+COMPLETE_TOP_K = 50
+_COMPLETE_CACHE_MAX = 2048
+# SymSpell-style fuzzy lookup: every delete (up to FUZZY_MAX_DISTANCE characters) of the
+# first FUZZY_PREFIX characters of a tag is indexed, so typo lookups never scan the table.
+FUZZY_MAX_DISTANCE = 2
+FUZZY_PREFIX = 7
+
+
+def normalize_ui_category(raw_category: str, tag: str) -> str:
+    raw = (raw_category or "").strip().lower()
+    tl = (tag or "").strip().lower()
+
+    if not raw:
+        return "general"
+
+    if raw.startswith("namespace"):
+        # The source file explodes any "namespaced" tag (contains ':') into a unique category,
+        # which clutters the UI. Collapse them into a small set of common-sense buckets.
+        if tl.startswith(("<", ">", ":")):
+            return "expression"
+        if RE_TIME_TAG.match(tl):
+            return "general"
+        return "fandom"
+
+    mapped = CATEGORY_MAP.get(raw)
+    if mapped:
+        return mapped
+
+    # Fallback: keep unknown categories (should be rare) but normalize to lowercase.
+    return raw
+
+
+def parse_tags_lines(lines):
+    """Return (tag, count, raw_category) rows in source order from reference lines."""
+    rows = []
+    current_category_raw = ""
+    for line in lines:
+        line = line.strip()
+        m_cat = RE_CATEGORY.match(line)
+        if m_cat:
+            current_category_raw = (m_cat.group(1) or "").strip()
+            continue
+        m_tag = RE_TAG.match(line)
+        if not m_tag:
+            continue
+        tag = (m_tag.group(1) or "").strip()
+        if not tag:
+            continue
+        try:
+            count = int(m_tag.group(2) or "0")
+        except Exception:
+            count = 0
+        rows.append((tag, count, current_category_raw))
+    return rows
+
+
+def parse_tags_md(path: str):
+    """Return (tag, count, raw_category) rows in source order."""
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_tags_lines(f)
+
+
+def source_signature(path: str):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def source_hash(path: str) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.digest()
+
+
+def _string_table(values):
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    if encoded:
+        # +1 for the "\n" separator after each entry.
+        offsets[1:] = np.cumsum([len(b) + 1 for b in encoded])
+    return offsets, b"".join(b + b"\n" for b in encoded)
+
+
+def _trigram_codes(data: np.ndarray) -> np.ndarray:
+    """24-bit codes for every byte trigram in a uint8 array (no separator handling)."""
+    data = data.astype(np.uint32)
+    return (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+
+
+def _sorted_unique(values: np.ndarray) -> np.ndarray:
+    # Sort + neighbour compare; much faster than np.unique's hashing path on large int arrays.
+    values = np.sort(values)
+    if len(values) < 2:
+        return values
+    return values[np.r_[True, values[1:] != values[:-1]]]
+
+
+def _csr(keys: np.ndarray, ranks: np.ndarray):
+    """Sorted unique keys, offsets and ascending per-key ranks from parallel key/rank arrays."""
+    # uint64 so 32-bit keys (crc32) keep their order once shifted into the high half.
+    pairs = _sorted_unique((keys.astype(np.uint64) << np.uint64(32)) | ranks.astype(np.uint64))
+    pair_keys = pairs >> np.uint64(32)
+    first = np.flatnonzero(np.r_[True, pair_keys[1:] != pair_keys[:-1]]) if len(pairs) else pairs
+    offsets = np.append(first, len(pairs)).astype(np.uint32)
+    return pair_keys[first].astype(np.uint32), offsets, (pairs & np.uint64(0xFFFFFFFF)).astype(np.int32)
+
+
+def _build_trigrams(lower_pool: bytes, lower_offsets: np.ndarray, pop_rank: np.ndarray):
+    """CSR trigram postings over popularity ranks, built without a Python-level loop."""
+    pool = np.frombuffer(lower_pool, dtype=np.uint8)
+    if len(pool) < 3:
+        return np.zeros(0, np.uint32), np.zeros(1, np.uint32), np.zeros(0, np.int32)
+    codes = _trigram_codes(pool)
+    newline = pool == ord("\n")
+    # Drop trigrams that straddle the separator between two tags.
+    keep = ~(newline[:-2] | newline[1:-1] | newline[2:])
+    rows = np.searchsorted(lower_offsets, np.nonzero(keep)[0], side="right") - 1
+    return _csr(codes[keep], pop_rank[rows])
+
+
+def _deletes(term: str, distance: int):
+    """term plus every string reachable from it by deleting up to distance characters."""
+    out = {term}
+    edge = {term}
+    for _ in range(distance):
+        edge = {word[:i] + word[i + 1 :] for word in edge for i in range(len(word))}
+        out |= edge
+    return out
+
+
+def _delete_hash(term: str) -> int:
+    return zlib.crc32(term.encode("utf-8"))
+
+
+def _build_deletes(alpha_lowers, pop_rank: np.ndarray):
+    """CSR delete-hash postings; crc32 collisions only add candidates that fail verification."""
+    prefix_ids = {}
+    row_prefix = np.empty(len(alpha_lowers), dtype=np.int64)
+    hashes = []
+    for row, lower in enumerate(alpha_lowers):
+        prefix = lower[:FUZZY_PREFIX]
+        pid = prefix_ids.get(prefix)
+        if pid is None:
+            pid = prefix_ids[prefix] = len(hashes)
+            hashes.append(np.array([_delete_hash(d) for d in _deletes(prefix, FUZZY_MAX_DISTANCE)], np.uint32))
+        row_prefix[row] = pid
+    if not hashes:
+        return np.zeros(0, np.uint32), np.zeros(1, np.uint32), np.zeros(0, np.int32)
+    # Expand each row into its prefix's hash list without a per-entry Python loop.
+    sizes = np.array([len(h) for h in hashes], dtype=np.int64)
+    starts = np.cumsum(sizes) - sizes
+    per_row = sizes[row_prefix]
+    first = np.repeat(starts[row_prefix], per_row)
+    within = np.arange(per_row.sum()) - np.repeat(np.cumsum(per_row) - per_row, per_row)
+    keys = np.concatenate(hashes)[first + within]
+    return _csr(keys, np.repeat(pop_rank, per_row))
+
+
+def _char_mask(term: str) -> int:
+    """64-bit set of character classes: a-z, 0-9, "_" and 27 shared buckets for the rest."""
+    mask = 0
+    for ch in term:
+        if "a" <= ch <= "z":
+            bit = ord(ch) - 97
+        elif "0" <= ch <= "9":
+            bit = ord(ch) - 48 + 26
+        elif ch == "_":
+            bit = 36
+        else:
+            bit = 37 + ord(ch) % 27
+        mask |= 1 << bit
+    return mask
+
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(masks: np.ndarray) -> np.ndarray:
+    return _POPCOUNT8[masks.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal-string-alignment (Damerau) distance, or max_distance + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # Shared prefixes and suffixes never change the distance; only the middle needs the DP.
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    # Keep one shared character on each side so adjacent transpositions still count.
+    start = max(0, start - 1)
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    end = max(0, end - 1)
+    a = a[start : len(a) - end]
+    b = b[start : len(b) - end]
+    # Only cells within max_distance of the diagonal can stay under the cutoff (Ukkonen band).
+    big = max_distance + 1
+    prev2 = None
+    prev = [j if j <= max_distance else big for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        cur = [big] * (len(b) + 1)
+        if i <= max_distance:
+            cur[0] = i
+        ca = a[i - 1]
+        lo = max(1, i - max_distance)
+        hi = min(len(b), i + max_distance)
+        best = cur[0]
+        for j in range(lo, hi + 1):
+            value = prev[j - 1] + (ca != b[j - 1])
+            if prev[j] + 1 < value:
+                value = prev[j] + 1
+            if cur[j - 1] + 1 < value:
+                value = cur[j - 1] + 1
+            if prev2 is not None and j > 1 and ca == b[j - 2] and a[i - 2] == b[j - 1] and prev2[j - 2] + 1 < value:
+                value = prev2[j - 2] + 1
+            cur[j] = value if value < big else big
+            if value < best:
+                best = value
+        if best > max_distance:
+            return big
+        prev2, prev = prev, cur
+    return min(prev[-1], max_distance + 1)
+
+
+def build_index_bytes(rows, signature=(0, 0), digest=b"\0" * 16) -> bytes:
+    """Serialize parsed (tag, count, raw_category) rows into the binary index format."""
+    n = len(rows)
+    lowers = [tag.lower() for tag, _, _ in rows]
+    # Alphabetical by tag_lower (ties keep source order); row i of the file is alpha rank i.
+    alpha = sorted(range(n), key=lambda i: (lowers[i], i))
+    rank = np.empty(n, dtype=np.int32)
+    rank[alpha] = np.arange(n, dtype=np.int32)
+
+    raw_names = []
+    raw_ids = {}
+    ui_rows = []
+    for tag, _count, raw in rows:
+        if raw not in raw_ids:
+            raw_ids[raw] = len(raw_names)
+            raw_names.append(raw)
+        ui_rows.append(normalize_ui_category(raw, tag))
+    ui_sizes = {}
+    for key in ui_rows:
+        ui_sizes[key] = ui_sizes.get(key, 0) + 1
+    ui_names = sorted(ui_sizes, key=lambda k: (-ui_sizes[k], k.lower()))
+    ui_ids = {key: i for i, key in enumerate(ui_names)}
+
+    counts = np.array([rows[i][1] for i in alpha], dtype=np.int64)
+    category = np.array([ui_ids[ui_rows[i]] for i in alpha], dtype=np.uint16)
+    category_raw = np.array([raw_ids[rows[i][2]] for i in alpha], dtype=np.uint16)
+    # Alpha position already breaks count ties by tag_lower.
+    by_count = np.lexsort((np.arange(n), -counts)).astype(np.int32)
+    lower_offsets, lower_pool = _string_table(lowers[i] for i in alpha)
+    tag_offsets, tag_pool = _string_table(rows[i][0] for i in alpha)
+    pop_rank = np.empty(n, dtype=np.int32)
+    pop_rank[by_count] = np.arange(n, dtype=np.int32)
+    gram_keys, gram_offsets, gram_postings = _build_trigrams(lower_pool, lower_offsets, pop_rank)
+    alpha_lowers = [lowers[i] for i in alpha]
+    fuzzy_keys, fuzzy_offsets, fuzzy_postings = _build_deletes(alpha_lowers, pop_rank)
+    char_masks = np.array([_char_mask(lower) for lower in alpha_lowers], dtype=np.uint64)
+
+    sections = {
+        "meta": json.dumps({"categories": ui_names, "raw_categories": raw_names}).encode("utf-8"),
+        "lower_offsets": lower_offsets.tobytes(),
+        "lower_pool": lower_pool,
+        "tag_offsets": tag_offsets.tobytes(),
+        "tag_pool": tag_pool,
+        "counts": counts.tobytes(),
+        "category": category.tobytes(),
+        "category_raw": category_raw.tobytes(),
+        "by_count": by_count.tobytes(),
+        "file_order": rank.tobytes(),
+        "gram_keys": gram_keys.tobytes(),
+        "gram_offsets": gram_offsets.tobytes(),
+        "gram_postings": gram_postings.tobytes(),
+        "fuzzy_keys": fuzzy_keys.tobytes(),
+        "fuzzy_offsets": fuzzy_offsets.tobytes(),
+        "fuzzy_postings": fuzzy_postings.tobytes(),
+        "char_masks": char_masks.tobytes(),
+    }
+    out = bytearray(_HEADER.size + _TABLE.size)
+    table = []
+    for name in _SECTIONS:
+        out.extend(b"\0" * (-len(out) % _ALIGN))
+        table.extend((len(out), len(sections[name])))
+        out.extend(sections[name])
+    _HEADER.pack_into(out, 0, _MAGIC, _VERSION, n, signature[0], signature[1], digest)
+    _TABLE.pack_into(out, _HEADER.size, *table)
+    return bytes(out)
+
+
+def write_index(idx_path: str, data: bytes) -> bool:
+    """Atomically replace idx_path with data; returns False if it could not be written."""
+    tmp = f"{idx_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, idx_path)
+        return True
+    except OSError as err:
+        # e.g. Windows refuses to replace a file another process has mapped.
+        logger.warning("CozyGen: could not write tag index %s: %s", idx_path, err)
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+
+def stamp_signature(data: bytes, signature) -> bytes:
+    """Return a copy of compiled index bytes with the source signature in the header replaced."""
+    magic, version, rows, _size, _mtime_ns, digest = _HEADER.unpack_from(data, 0)
+    return _HEADER.pack(magic, version, rows, signature[0], signature[1], digest) + bytes(data[_HEADER.size :])
+
+
+def _restamp_index(idx_path: str, index: "TagIndex", signature) -> None:
+    """Record a new source signature in idx_path's header, in place; the body is unchanged.
+
+    Used when the source was touched but its content hash still matches, so later loads
+    recognise it by signature instead of rehashing the whole reference.
+    """
+    header = stamp_signature(bytes(index._buf[: _HEADER.size]), signature)
+    try:
+        with open(idx_path, "r+b") as f:
+            f.write(header)
+    except OSError as err:
+        logger.warning("CozyGen: could not update tag index header %s: %s", idx_path, err)
+        return
+    index.signature = tuple(signature)
+
+
+def compile_index(md_path: str, idx_path: str) -> bytes:
+    """Parse md_path and atomically write its compiled index to idx_path; returns the bytes."""
+    signature = source_signature(md_path)
+    data = build_index_bytes(parse_tags_md(md_path), signature, source_hash(md_path))
+    # If the write fails the caller serves the returned bytes from memory.
+    write_index(idx_path, data)
+    return data
+
+
+def read_header(buf):
+    magic, version, rows, size, mtime_ns, digest = _HEADER.unpack_from(buf, 0)
+    if magic != _MAGIC or version != _VERSION:
+        return None
+    return {"rows": rows, "signature": (size, mtime_ns), "hash": digest}
+
+
+class TagIndex:
+    """Read-only view over a compiled index held in an mmap (or any bytes-like buffer)."""
+
+    def __init__(self, buf, source=None):
+        header = read_header(buf)
+        if header is None:
+            raise ValueError("not a CozyGen tag index")
+        self._buf = buf
+        self.source = source
+        self.signature = header["signature"]
+        self.hash = header["hash"]
+        self.rows = header["rows"]
+        table = _TABLE.unpack_from(buf, _HEADER.size)
+        self._sections = {name: (table[2 * i], table[2 * i + 1]) for i, name in enumerate(_SECTIONS)}
+        meta = json.loads(bytes(self._raw("meta")).decode("utf-8"))
+        self.category_keys = meta["categories"]
+        self.raw_categories = meta["raw_categories"]
+        self.lower_offsets = self._array("lower_offsets", np.uint32)
+        self.tag_offsets = self._array("tag_offsets", np.uint32)
+        self.counts = self._array("counts", np.int64)
+        self.category = self._array("category", np.uint16)
+        self.category_raw = self._array("category_raw", np.uint16)
+        self.by_count = self._array("by_count", np.int32)
+        self.file_order = self._array("file_order", np.int32)
+        self.gram_keys = self._array("gram_keys", np.uint32)
+        self.gram_offsets = self._array("gram_offsets", np.uint32)
+        self.gram_postings = self._array("gram_postings", np.int32)
+        self.fuzzy_keys = self._array("fuzzy_keys", np.uint32)
+        self.fuzzy_offsets = self._array("fuzzy_offsets", np.uint32)
+        self.fuzzy_postings = self._array("fuzzy_postings", np.int32)
+        self.char_masks = self._array("char_masks", np.uint64)
+        self._lowers = None
+        self._tags = None
+        self._pop_rank = None
+        self._lengths = None
+        self._top_k = None
+        self._complete_cache = OrderedDict()
+
+    def _raw(self, name):
+        offset, length = self._sections[name]
+        return memoryview(self._buf)[offset : offset + length]
+
+    def _array(self, name, dtype):
+        offset, length = self._sections[name]
+        return np.frombuffer(self._buf, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+    def __len__(self):
+        return self.rows
+
+    def _strings(self, name):
+        return bytes(self._raw(name)).decode("utf-8").split("\n")[: self.rows]
+
+    @property
+    def lowers(self):
+        """All lowercase tags in row (alphabetical) order, decoded once on first use."""
+        if self._lowers is None:
+            self._lowers = self._strings("lower_pool")
+        return self._lowers
+
+    @property
+    def tags(self):
+        if self._tags is None:
+            raw = self._strings("tag_pool")
+            # Most tags are already lowercase; share those string objects with lowers.
+            self._tags = [lower if tag == lower else tag for tag, lower in zip(raw, self.lowers)]
+        return self._tags
+
+    def lower_bytes(self, row: int) -> bytes:
+        return bytes(self._raw("lower_pool")[int(self.lower_offsets[row]) : int(self.lower_offsets[row + 1]) - 1])
+
+    def find(self, tag_lower: str) -> int:
+        """Row of tag_lower via binary search over the mapped string table, or -1."""
+        needle = tag_lower.encode("utf-8")
+        lo, hi = 0, self.rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.lower_bytes(mid) < needle:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.rows and self.lower_bytes(lo) == needle:
+            return lo
+        return -1
+
+    def __contains__(self, tag_lower):
+        return self.find(tag_lower) >= 0
+
+    def prefix_range(self, prefix: str):
+        """[lo, hi) rows whose tag_lower starts with prefix (rows are alphabetical)."""
+        lowers = self.lowers
+        lo = bisect.bisect_left(lowers, prefix)
+        return lo, bisect.bisect_left(lowers, prefix + "\U0010ffff", lo)
+
+    def _top_rows(self, lo: int, hi: int, k: int):
+        """The k most popular rows in [lo, hi), ordered by (-count, row)."""
+        counts = self.counts[lo:hi]
+        if hi - lo > k:
+            part = np.argpartition(-counts, k - 1)[:k]
+            # argpartition breaks count ties arbitrarily; widen to every row tied with the k-th.
+            part = np.nonzero(counts >= counts[part].min())[0]
+        else:
+            part = np.arange(hi - lo)
+        order = part[np.lexsort((part, -counts[part]))][:k]
+        return (order + lo).astype(np.int32)
+
+    def warm(self):
+        """Decode the string pool and build the autocomplete buckets now instead of on first use."""
+        if self._lowers is None:
+            self._lowers = self._strings("lower_pool")
+        self.build_completions()
+
+    def build_completions(self):
+        """Precompute the top COMPLETE_TOP_K rows for every one- and two-byte prefix."""
+        if self._top_k is not None:
+            return
+        if not self.rows:
+            self._top_k = {}
+            return
+        pool = self._array("lower_pool", np.uint8)
+        starts = self.lower_offsets[:-1].astype(np.int64)
+        first = pool[starts].astype(np.int32)
+        # A one-byte tag is followed by its "\n" separator, so it only joins its 1-byte bucket.
+        second = pool[np.minimum(starts + 1, len(pool) - 1)].astype(np.int32)
+        top = {}
+        for keys, width in ((first, 1), ((first << 8) | second, 2)):
+            bounds = np.flatnonzero(np.diff(keys)) + 1
+            for lo, hi in zip(np.r_[0, bounds].tolist(), np.r_[bounds, self.rows].tolist()):
+                key = bytes([keys[lo]]) if width == 1 else bytes([keys[lo] >> 8, keys[lo] & 0xFF])
+                if width == 2 and key[1] == 0x0A:
+                    continue
+                top[key] = self._top_rows(lo, hi, COMPLETE_TOP_K)
+        self._top_k = top
+
+    def complete(self, prefix: str, category: int = -1, limit: int = 10):
+        """Most popular rows starting with prefix, memoized per (prefix, category, limit)."""
+        key = (prefix, category, limit)
+        cached = self._complete_cache.get(key)
+        if cached is not None:
+            self._complete_cache.move_to_end(key)
+            return cached
+        encoded = prefix.encode("utf-8")
+        if category < 0 and limit <= COMPLETE_TOP_K and len(encoded) <= 2:
+            self.build_completions()
+            rows = self._top_k.get(encoded, np.zeros(0, np.int32))[:limit]
+        else:
+            lo, hi = self.prefix_range(prefix)
+            if category >= 0:
+                in_range = np.nonzero(self.category[lo:hi] == category)[0] + lo
+                counts = self.counts[in_range]
+                rows = in_range[np.lexsort((in_range, -counts))][:limit]
+            else:
+                rows = self._top_rows(lo, hi, limit)
+        result = rows.tolist()
+        self._complete_cache[key] = result
+        if len(self._complete_cache) > _COMPLETE_CACHE_MAX:
+            self._complete_cache.popitem(last=False)
+        return result
+
+    def category_id(self, key: str) -> int:
+        try:
+            return self.category_keys.index(key)
+        except ValueError:
+            return -1
+
+    def category_sizes(self):
+        return np.bincount(self.category, minlength=len(self.category_keys))
+
+    def _postings(self, code: int, keys=None, offsets=None, postings=None):
+        if keys is None:
+            keys, offsets, postings = self.gram_keys, self.gram_offsets, self.gram_postings
+        i = int(np.searchsorted(keys, code))
+        if i >= len(keys) or int(keys[i]) != code:
+            return np.zeros(0, dtype=np.int32)
+        return postings[int(offsets[i]) : int(offsets[i + 1])]
+
+    def _qgram_filter(self, term: str, ranks: np.ndarray, max_distance: int):
+        """Drop candidates sharing too few of term's trigrams to be within max_distance.
+
+        One OSA edit (a transposition at worst) destroys at most four of an ASCII term's
+        distinct trigrams, so a match keeps at least len(grams) - 4 * max_distance of them.
+        """
+        if not term.isascii():
+            return ranks
+        grams = np.unique(_trigram_codes(np.frombuffer(term.encode("utf-8"), dtype=np.uint8)))
+        need = len(grams) - 4 * max_distance
+        if need <= 0 or not len(ranks):
+            return ranks
+        shared = np.zeros(len(ranks), dtype=np.int32)
+        for code in grams.tolist():
+            shared += np.isin(ranks, self._postings(code), assume_unique=True)
+        return ranks[shared >= need]
+
+    def fuzzy(self, term: str, limit: int = 8, max_distance: int = FUZZY_MAX_DISTANCE):
+        """Rows within max_distance edits of term: closer first, then by popularity.
+
+        Duplicate spellings (the same tag listed under several categories) yield only their
+        most popular row.
+        """
+        term = term.lower()
+        max_distance = min(max_distance, FUZZY_MAX_DISTANCE)
+        tables = (self.fuzzy_keys, self.fuzzy_offsets, self.fuzzy_postings)
+        hashes = {_delete_hash(d) for d in _deletes(term[:FUZZY_PREFIX], max_distance)}
+        lists = [self._postings(code, *tables) for code in hashes]
+        lists = [p for p in lists if len(p)]
+        if not lists:
+            return []
+        ranks = _sorted_unique(np.concatenate(lists))
+        ranks = self._qgram_filter(term, ranks, max_distance)
+        rows = self.by_count[ranks]
+        # An edit changes the length by at most one, and adds or removes at most one
+        # character class, so both differences bound the distance from below.
+        rows = rows[np.abs(self.lengths[rows] - len(term)) <= max_distance]
+        term_mask = np.uint64(_char_mask(term))
+        masks = self.char_masks[rows]
+        missing = np.maximum(_popcount(masks & ~term_mask), _popcount(term_mask & ~masks))
+        rows = rows[missing <= max_distance]
+        lowers = self.lowers
+        by_distance = [[] for _ in range(max_distance + 1)]
+        seen = set()
+        for row in rows.tolist():
+            lower = lowers[row]
+            if lower in seen:
+                continue
+            seen.add(lower)
+            distance = edit_distance(term, lower, max_distance)
+            if distance <= max_distance:
+                by_distance[distance].append(row)
+        return [row for bucket in by_distance for row in bucket][:limit]
+
+    @property
+    def lengths(self):
+        """Character length of every tag_lower."""
+        if self._lengths is None:
+            self._lengths = np.fromiter(map(len, self.lowers), dtype=np.int32, count=self.rows)
+        return self._lengths
+
+    @property
+    def pop_rank(self):
+        """Inverse of by_count: the popularity rank of each row."""
+        if self._pop_rank is None:
+            rank = np.empty(self.rows, dtype=np.int32)
+            rank[self.by_count] = np.arange(self.rows, dtype=np.int32)
+            self._pop_rank = rank
+        return self._pop_rank
+
+    def _scan_ranks(self, data: np.ndarray):
+        """Popularity ranks of rows containing a 1-2 byte token, via a vectorized pool scan."""
+        pool = self._array("lower_pool", np.uint8)
+        hits = pool[: len(pool) - len(data) + 1] == data[0]
+        for i in range(1, len(data)):
+            hits &= pool[i : len(pool) - len(data) + 1 + i] == data[i]
+        rows = np.searchsorted(self.lower_offsets, np.nonzero(hits)[0], side="right") - 1
+        return _sorted_unique(self.pop_rank[rows])
+
+    def _candidate_ranks(self, tokens):
+        """Ranks that contain every trigram (or short token) of every token, ascending."""
+        lists = []
+        for token in tokens:
+            data = np.frombuffer(token.encode("utf-8"), dtype=np.uint8)
+            if len(data) >= 3:
+                lists.extend(self._postings(int(code)) for code in np.unique(_trigram_codes(data)))
+            elif len(data):
+                lists.append(self._scan_ranks(data))
+        if not lists:
+            return None
+        lists.sort(key=len)
+        ranks = lists[0]
+        for other in lists[1:]:
+            if not len(ranks):
+                break
+            ranks = np.intersect1d(ranks, other, assume_unique=True)
+        return ranks
+
+    def match(self, tokens, category: int = -1, min_count: int = 0, limit: int = 0):
+        """Rows whose tag_lower contains every token, in popularity order.
+
+        Trigram postings (or a byte scan for tokens under three bytes) narrow the candidates;
+        only tokens longer than a trigram need a real substring check on the survivors.
+        limit > 0 stops after that many matches.
+        """
+        ranks = self._candidate_ranks(tokens)
+        rows = self.by_count if ranks is None else self.by_count[ranks]
+        if category >= 0 or min_count > 0:
+            rows = self.select(category, min_count, rows=rows, ordered=True)
+        checks = [token for token in tokens if len(token.encode("utf-8")) > 3]
+        if not checks:
+            return rows[:limit] if limit else rows
+        lowers = self.lowers
+        if limit:
+            matched = []
+            for row in rows.tolist():
+                tl = lowers[row]
+                if all(token in tl for token in checks):
+                    matched.append(row)
+                    if len(matched) >= limit:
+                        break
+        elif len(checks) == 1:
+            token = checks[0]
+            matched = [row for row in rows.tolist() if token in lowers[row]]
+        else:
+            matched = [row for row in rows.tolist() if all(token in lowers[row] for token in checks)]
+        return np.array(matched, dtype=np.int32)
+
+    def select(self, category: int = -1, min_count: int = 0, sort: str = "count", rows=None, ordered=False):
+        """Rows matching the filters, in popularity ("count") or alphabetical order.
+
+        rows optionally restricts the result to a candidate set (any order, or already in the
+        requested order when ordered=True).
+        """
+        if rows is None:
+            order = self.by_count if sort != "alpha" else np.arange(self.rows, dtype=np.int32)
+        elif ordered:
+            order = np.asarray(rows, dtype=np.int32)
+        else:
+            rows = np.asarray(rows, dtype=np.int32)
+            if sort == "alpha":
+                order = np.sort(rows)
+            else:
+                # by_count ranks are implied by (-count, row) since rows are alpha-ordered.
+                order = rows[np.lexsort((rows, -self.counts[rows]))]
+        mask = None
+        if category >= 0:
+            mask = self.category[order] == category
+        if min_count > 0:
+            above = self.counts[order] >= min_count
+            mask = above if mask is None else mask & above
+        return order if mask is None else order[mask]
+
+
+def _map_file(idx_path: str):
+    with open(idx_path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_index(md_path: str, idx_path: str) -> TagIndex:
+    """Map idx_path if it was compiled from md_path's current content, else recompile it."""
+    signature = source_signature(md_path)
+    try:
+        mapped = _map_file(idx_path)
+        index = TagIndex(mapped, source=md_path)
+        if index.signature == signature:
+            return index
+        if index.hash == source_hash(md_path):
+            _restamp_index(idx_path, index, signature)
+            return index
+        # The column views pin the mapping, so it cannot be closed explicitly; it is
+        # unmapped once the stale index is garbage collected.
+        del index, mapped
+    except (OSError, ValueError, struct.error):
+        pass
+    logger.info("CozyGen: compiling tag index from %s", md_path)
+    data = compile_index(md_path, idx_path)
+    try:
+        index = TagIndex(_map_file(idx_path), source=md_path)
+        if index.hash == read_header(data)["hash"]:
+            return index
+    except (OSError, ValueError, struct.error):
+        pass
+    return TagIndex(data, source=md_path)
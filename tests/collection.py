@@ -0,0 +1,13 @@
+import os
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pytest_collect_directory(path, parent):
+    # Collect the repository root as a plain directory: as a package pytest would import
+    # its __init__, which registers the nodes and routes with a running ComfyUI.
+    if str(path) == REPO_DIR:
+        return pytest.Dir.from_parent(parent, path=path)
+    return None
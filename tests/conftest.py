@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The pure helper modules have no ComfyUI imports, so tests load them as top-level
+# modules instead of through the package __init__ (which needs a running ComfyUI).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
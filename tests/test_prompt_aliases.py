@@ -0,0 +1,49 @@
+from prompt_aliases import AliasLookup
+
+# Cases ported from js/src/__tests__/promptAliases.test.js (applyPromptAliases -> AliasLookup.expand).
+
+
+def expand(text, aliases):
+    return AliasLookup(aliases).expand(text)
+
+
+def test_expands_weighted_aliases_into_per_tag_weights():
+    aliases = {"hero": "tag_one, tag_two"}
+    assert expand("($hero$:0.7), background", aliases) == "(tag_one:0.7), (tag_two:0.7), background"
+
+
+def test_replaces_unweighted_aliases_as_before():
+    assert expand("$hero$, background", {"hero": "tag_one, tag_two"}) == "tag_one, tag_two, background"
+
+
+def test_overrides_existing_tag_weights_inside_weighted_aliases():
+    assert expand("($hero$:0.7)", {"hero": "(tag_one:1.2), tag_two"}) == "(tag_one:0.7), (tag_two:0.7)"
+
+
+def test_expands_nested_aliases_up_to_the_max_pass():
+    assert expand("$a$", {"a": "$b$", "b": "tag_one, tag_two"}) == "tag_one, tag_two"
+
+
+def test_falls_back_to_unqualified_alias_names_when_unique():
+    assert expand("$scene$", {"PROMPTS::scene": "tag_one, tag_two"}) == "tag_one, tag_two"
+
+
+def test_keeps_ambiguous_unqualified_aliases_untouched():
+    assert expand("$scene$", {"PROMPTS::scene": "tag_one", "CHAR::scene": "tag_two"}) == "$scene$"
+
+
+def test_expands_bare_category_alias_tokens_when_mapped():
+    aliases = {"media_char::movies_lara_croft": "tag_one"}
+    assert expand("media_char::movies_lara_croft, tag_two", aliases) == "tag_one, tag_two"
+
+
+def test_strips_category_prefix_for_unknown_bare_aliases():
+    aliases = {"media_char::movies_lara_croft": "tag_one"}
+    assert expand("lighting::particle_sunbeam_dust, tag_two", aliases) == "particle_sunbeam_dust, tag_two"
+
+
+def test_expand_form_returns_the_same_dict_when_nothing_changed():
+    lookup = AliasLookup({"hero": "tag_one"})
+    form = {"prompt": "plain", "steps": 20}
+    assert lookup.expand_form(form) is form
+    assert lookup.expand_form({"prompt": "$hero$", "steps": 20}) == {"prompt": "tag_one", "steps": 20}
@@ -0,0 +1,70 @@
+from prompt_tokens import element_weight, parse_prompt_elements, prompt_tokens
+
+# Cases ported from js/src/__tests__/tokenWeights.test.js, plus the spans the browser reports.
+
+
+def test_keeps_weighted_groups_with_commas_together():
+    text = "(tag_one, tag_two:1.2), third"
+    elements = parse_prompt_elements(text)
+    assert len(elements) == 2
+    assert elements[0]["text"] == "tag_one, tag_two"
+    assert element_weight(text, elements[0]) == 1.2
+
+
+def test_parses_weighted_aliases_as_a_single_alias_element():
+    text = "($alias_key$:1.5), tag"
+    elements = parse_prompt_elements(text)
+    assert elements[0]["type"] == "alias"
+    assert elements[0]["text"] == "alias_key"
+
+
+def test_element_spans_cover_the_weight_wrapper():
+    text = "(tag_one, tag_two:1.2), third"
+    assert parse_prompt_elements(text) == [
+        {"type": "tag", "text": "tag_one, tag_two", "start": 0, "end": 22},
+        {"type": "tag", "text": "third", "start": 24, "end": 29},
+    ]
+    text = "($alias_key$:1.5), tag"
+    elements = parse_prompt_elements(text)
+    assert elements == [
+        {"type": "alias", "text": "alias_key", "start": 0, "end": 17},
+        {"type": "tag", "text": "tag", "start": 19, "end": 22},
+    ]
+    assert element_weight(text, elements[0]) == 1.5
+    assert element_weight(text, elements[1]) is None
+
+
+def test_unweighted_alias_span_is_the_dollar_token():
+    text = "$a$, b"
+    elements = parse_prompt_elements(text)
+    assert elements == [
+        {"type": "alias", "text": "a", "start": 0, "end": 3},
+        {"type": "tag", "text": "b", "start": 5, "end": 6},
+    ]
+    assert element_weight(text, elements[0]) is None
+
+
+def test_blank_prompt_has_no_elements():
+    assert parse_prompt_elements("") == []
+    assert parse_prompt_elements(" ,\n ") == []
+
+
+def test_weighted_group_yields_one_token_per_tag():
+    text = "(tag_one, tag_two:1.2), third"
+    assert prompt_tokens(text) == [
+        {"type": "tag", "text": "tag_one", "start": 1, "end": 8, "weight": 1.2},
+        {"type": "tag", "text": "tag_two", "start": 10, "end": 17, "weight": 1.2},
+        {"type": "tag", "text": "third", "start": 24, "end": 29, "weight": None},
+    ]
+
+
+def test_weighted_alias_token_keeps_its_weight():
+    assert prompt_tokens("($alias_key$:1.5), tag") == [
+        {"type": "alias", "text": "alias_key", "start": 0, "end": 17, "weight": 1.5},
+        {"type": "tag", "text": "tag", "start": 19, "end": 22, "weight": None},
+    ]
+
+
+def test_bare_category_references_are_aliases():
+    tokens = prompt_tokens("media_char::lara, tag_two")
+    assert [(t["type"], t["text"]) for t in tokens] == [("alias", "media_char::lara"), ("tag", "tag_two")]
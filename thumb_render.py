@@ -0,0 +1,327 @@
+import contextlib
+import logging
+import os
+import shutil
+import struct
+import subprocess
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageOps
+
+from .thumb_store import render_path
+
+try:
+    import av  # PyAV (bundled with recent ComfyUI); enables in-process frame decoding
+except ImportError:
+    av = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp", ".tif", ".tiff")
+VIDEO_EXTS = (".mp4", ".webm", ".mov", ".mkv")
+AUDIO_EXTS = (".mp3", ".wav", ".flac")
+
+
+def thumb_path(fp: str, w: int) -> str:
+    return render_path(fp, f"w{w}.jpg")
+
+
+def save_thumb_image(im: Image.Image, dest: str, w: int):
+    im = ImageOps.exif_transpose(im).convert("RGB")
+    im.thumbnail((w, w), Image.Resampling.LANCZOS)
+    im.save(dest, "JPEG", quality=85, optimize=True, progressive=True)
+
+
+def make_image_thumb(src: str, dest: str, w: int):
+    with Image.open(src) as im:
+        save_thumb_image(im, dest, w)
+
+
+def decode_video_keyframe(src: str):
+    """Decode the first keyframe in-process with PyAV; returns None when unavailable."""
+    if av is None:
+        return None
+    try:
+        with av.open(src) as container:
+            if not container.streams.video:
+                return None
+            stream = container.streams.video[0]
+            stream.codec_context.skip_frame = "NONKEY"
+            for frame in container.decode(stream):
+                return frame.to_image()
+    except Exception as err:
+        logger.debug("CozyGen: PyAV could not decode %s: %s", src, err)
+    return None
+
+
+def ffmpeg_exe():
+    exe = shutil.which("ffmpeg")
+    if exe:
+        return exe
+    try:
+        import imageio_ffmpeg
+
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+def make_video_thumb(src: str, dest: str, w: int):
+    frame = decode_video_keyframe(src)
+    if frame is not None:
+        save_thumb_image(frame, dest, w)
+        return
+    exe = ffmpeg_exe()
+    if exe:
+        cmd = [
+            exe,
+            "-y",
+            "-ss",
+            "0.10",
+            "-i",
+            src,
+            "-vframes",
+            "1",
+            "-vf",
+            f"scale='min({w},iw)':-1",
+            "-q:v",
+            "5",
+            "-f",
+            "mjpeg",
+            dest,
+        ]
+        try:
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            if os.path.exists(dest) and os.path.getsize(dest) > 0:
+                return
+        except Exception:
+            pass
+    logger.debug("CozyGen: no video decoder produced a frame for %s, using placeholder", src)
+    H = int(w * 9 / 16)
+    img = Image.new("RGB", (w, H), (40, 40, 48))
+    d = ImageDraw.Draw(img)
+    d.polygon(
+        [(int(w * 0.38), int(H * 0.30)), (int(w * 0.72), int(H * 0.50)), (int(w * 0.38), int(H * 0.70))],
+        fill=(240, 240, 240),
+    )
+    img.save(dest, "JPEG", quality=85, optimize=True, progressive=True)
+
+
+# Audio outputs get a waveform instead of a video frame. PCM is decoded in chunks
+# (PyAV in-process, ffmpeg pipe as fallback), reduced to fixed-size blocks as it
+# streams, then folded into WAVEFORM_BUCKETS peak/RMS pairs cached as uint8.
+_WAVEFORM_RATE = 8000
+_WAVEFORM_BLOCK = 64
+WAVEFORM_BUCKETS = 1024
+_WAVEFORM_MAGIC = b"CZPK"
+_WAVEFORM_HEADER = struct.Struct("<4sHIf")
+
+
+def _iter_pcm_pyav(src: str):
+    if av is None:
+        raise RuntimeError("PyAV not available")
+    with av.open(src) as container:
+        if not container.streams.audio:
+            raise RuntimeError("no audio stream")
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=_WAVEFORM_RATE)
+        for frame in container.decode(container.streams.audio[0]):
+            for out in resampler.resample(frame):
+                yield out.to_ndarray().reshape(-1)
+        for out in resampler.resample(None):
+            yield out.to_ndarray().reshape(-1)
+
+
+def _iter_pcm_ffmpeg(src: str):
+    exe = ffmpeg_exe()
+    if not exe:
+        raise RuntimeError("ffmpeg not available")
+    cmd = [exe, "-v", "error", "-i", src, "-vn", "-ac", "1", "-ar", str(_WAVEFORM_RATE), "-f", "f32le", "-"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        tail = b""
+        while True:
+            buf = proc.stdout.read(1 << 16)
+            if not buf:
+                break
+            buf = tail + buf
+            usable = len(buf) - (len(buf) % 4)
+            tail = buf[usable:]
+            if usable:
+                yield np.frombuffer(buf[:usable], dtype="<f4")
+    finally:
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with {proc.returncode}")
+
+
+def compute_peaks(src: str) -> dict:
+    for reader in (_iter_pcm_pyav, _iter_pcm_ffmpeg):
+        block_peaks = []
+        block_sumsq = []
+        carry = np.zeros(0, dtype=np.float32)
+        samples = 0
+        try:
+            for chunk in reader(src):
+                samples += len(chunk)
+                data = np.concatenate((carry, np.abs(chunk.astype(np.float32, copy=False))))
+                usable = len(data) - (len(data) % _WAVEFORM_BLOCK)
+                blocks = data[:usable].reshape(-1, _WAVEFORM_BLOCK)
+                block_peaks.append(blocks.max(axis=1))
+                block_sumsq.append(np.square(blocks).sum(axis=1))
+                carry = data[usable:]
+        except Exception as err:
+            logger.debug("CozyGen: %s could not decode %s: %s", reader.__name__, src, err)
+            continue
+        if not samples:
+            continue
+        counts = [np.full(sum(len(b) for b in block_peaks), _WAVEFORM_BLOCK, dtype=np.float64)]
+        if len(carry):
+            block_peaks.append(carry.max(keepdims=True))
+            block_sumsq.append(np.square(carry).sum(keepdims=True))
+            counts.append(np.array([len(carry)], dtype=np.float64))
+        peaks = np.concatenate(block_peaks)
+        sumsq = np.concatenate(block_sumsq).astype(np.float64)
+        count = np.concatenate(counts)
+        buckets = min(WAVEFORM_BUCKETS, len(peaks))
+        edges = np.linspace(0, len(peaks), buckets, endpoint=False).astype(np.int64)
+        bucket_peaks = np.maximum.reduceat(peaks, edges)
+        bucket_rms = np.sqrt(np.add.reduceat(sumsq, edges) / np.add.reduceat(count, edges))
+        return {
+            "duration": samples / _WAVEFORM_RATE,
+            "peaks": np.clip(bucket_peaks * 255.0, 0, 255).astype(np.uint8),
+            "rms": np.clip(bucket_rms * 255.0, 0, 255).astype(np.uint8),
+        }
+    raise RuntimeError("unable to decode audio")
+
+
+def peaks_path(fp: str) -> str:
+    return render_path(fp, f"a{WAVEFORM_BUCKETS}.peaks")
+
+
+def read_peaks(path: str):
+    with open(path, "rb") as f:
+        raw = f.read()
+    magic, version, buckets, duration = _WAVEFORM_HEADER.unpack_from(raw)
+    if magic != _WAVEFORM_MAGIC or version != 1:
+        return None
+    body = np.frombuffer(raw, dtype=np.uint8, offset=_WAVEFORM_HEADER.size)
+    if len(body) != buckets * 2:
+        return None
+    return {"duration": float(duration), "peaks": body[:buckets], "rms": body[buckets:]}
+
+
+def ensure_peaks(fp: str, src: str):
+    """Return (peaks, written) for a source, computing and caching the peaks on a miss."""
+    path = peaks_path(fp)
+    if os.path.exists(path):
+        with contextlib.suppress(Exception):
+            cached = read_peaks(path)
+            if cached is not None:
+                return cached, False
+    data = compute_peaks(src)
+    tmp = f"{path}.part"
+    with open(tmp, "wb") as f:
+        f.write(_WAVEFORM_HEADER.pack(_WAVEFORM_MAGIC, 1, len(data["peaks"]), data["duration"]))
+        f.write(data["peaks"].tobytes())
+        f.write(data["rms"].tobytes())
+    os.replace(tmp, path)
+    return data, True
+
+
+def make_audio_thumb(peaks: dict, dest: str, w: int):
+    H = int(w * 9 / 16)
+    img = Image.new("RGB", (w, H), (40, 40, 48))
+    d = ImageDraw.Draw(img)
+    mid = H / 2
+    # Resample the bucket arrays to one column per pixel.
+    cols = np.linspace(0, len(peaks["peaks"]), w, endpoint=False).astype(np.int64)
+    col_peaks = peaks["peaks"][cols].astype(np.float32) / 255.0 * (H * 0.45)
+    col_rms = peaks["rms"][cols].astype(np.float32) / 255.0 * (H * 0.45)
+    for x in range(w):
+        d.line([(x, mid - col_peaks[x]), (x, mid + col_peaks[x])], fill=(120, 120, 150))
+        d.line([(x, mid - col_rms[x]), (x, mid + col_rms[x])], fill=(240, 240, 240))
+    img.save(dest, "JPEG", quality=85, optimize=True, progressive=True)
+
+
+# BlurHash placeholders (https://blurha.sh): ~28 characters per item, computed from the
+# rendered thumbnail and returned by the gallery list when include_placeholder=1.
+_BLURHASH_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+_BLURHASH_COMPONENTS = (4, 3)
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(_BLURHASH_CHARS[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def blurhash_encode(im: Image.Image) -> str:
+    cx, cy = _BLURHASH_COMPONENTS
+    small = im.convert("RGB")
+    small.thumbnail((32, 32), Image.Resampling.BILINEAR)
+    srgb = np.asarray(small, dtype=np.float64) / 255.0
+    linear = np.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+    h, w = linear.shape[:2]
+    basis_x = np.cos(np.pi * np.outer(np.arange(cx), np.arange(w)) / w)
+    basis_y = np.cos(np.pi * np.outer(np.arange(cy), np.arange(h)) / h)
+    # factors[j, i, c] = mean over pixels of basis_y[j] * basis_x[i] * linear[..., c]
+    factors = np.einsum("jy,ix,yxc->jic", basis_y, basis_x, linear) / (w * h)
+    factors[1:, :, :] *= 2
+    factors[0, 1:, :] *= 2
+    factors = factors.reshape(-1, 3)
+    dc, ac = factors[0], factors[1:]
+
+    def _to_srgb(v):
+        v = min(1.0, max(0.0, v))
+        v = v * 12.92 if v <= 0.0031308 else 1.055 * v ** (1 / 2.4) - 0.055
+        return int(round(v * 255))
+
+    out = _base83((cx - 1) + (cy - 1) * 9, 1)
+    max_ac = float(np.abs(ac).max()) if ac.size else 0.0
+    quant_max = int(max(0, min(82, np.floor(max_ac * 166 - 0.5))))
+    ac_scale = (quant_max + 1) / 166
+    out += _base83(quant_max, 1)
+    out += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    q = np.clip(np.floor(np.sign(ac) * np.abs(ac / ac_scale) ** 0.5 * 9 + 9.5), 0, 18).astype(int)
+    for r, g, b in q:
+        out += _base83(int(r) * 361 + int(g) * 19 + int(b), 2)
+    return out
+
+
+def placeholder_from(path: str):
+    try:
+        with Image.open(path) as im:
+            return blurhash_encode(im)
+    except Exception as err:
+        logger.debug("CozyGen: placeholder failed for %s: %s", path, err)
+    return None
+
+
+def render_thumb(src: str, filename: str, dest: str, w: int, fp: str):
+    """Render ``dest`` for ``src`` and return every cache file written.
+
+    The JPEG is written to ``dest + ".part"`` and moved into place, so readers of the
+    shared content-addressed path never see a partial file.
+    """
+    written = []
+    ext = os.path.splitext(filename)[1].lower()
+    tmp = f"{dest}.part"
+    try:
+        try:
+            if ext in IMAGE_EXTS:
+                make_image_thumb(src, tmp, w)
+            elif ext in VIDEO_EXTS:
+                make_video_thumb(src, tmp, w)
+            elif ext in AUDIO_EXTS:
+                peaks, created = ensure_peaks(fp, src)
+                if created:
+                    written.append(peaks_path(fp))
+                make_audio_thumb(peaks, tmp, w)
+            else:
+                make_video_thumb(src, tmp, w)
+        except Exception:
+            make_video_thumb(src, tmp, w)
+        os.replace(tmp, dest)
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+    written.append(dest)
+    return written
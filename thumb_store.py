@@ -0,0 +1,420 @@
+import atexit
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+EXT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(EXT_DIR, "data")
+THUMBS_DIR = os.path.join(DATA_DIR, "thumbs")
+# Renders are content-addressed: cas/<fp[:2]>/<fp>__<variant>, where <fp> is a
+# sampled content hash, so moved/renamed/duplicate sources share one render.
+CAS_DIR = os.path.join(THUMBS_DIR, "cas")
+INDEX_FILE = os.path.join(THUMBS_DIR, "index.json")
+
+_MAX_BYTES = max(0, int(os.getenv("COZYGEN_THUMB_CACHE_MB", "2048"))) * 1024 * 1024
+_LOW_WATER_RATIO = 0.9
+_SWEEP_INTERVAL_SECONDS = 60.0
+_PRUNE_INTERVAL_SECONDS = 3600.0
+_ATIME_TOUCH_SECONDS = 3600.0
+_FP_SAMPLE_BYTES = 64 * 1024
+_FP_FULL_HASH_MAX = 4 * _FP_SAMPLE_BYTES
+
+_LOCK = threading.Lock()
+_WAKE = threading.Event()
+# path -> [size, last_access]; iteration order is least-recently-used first.
+_ENTRIES: "OrderedDict[str, list]" = OrderedDict()
+_TOTAL_BYTES = 0
+_INDEXED = False
+_SWEEPER = None
+_STATS = {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0, "reclaimed": 0, "pruned": 0}
+
+# "which/subfolder/filename" -> [size, mtime_ns, fingerprint], persisted to INDEX_FILE.
+_FP_INDEX = None
+_FP_REFS: dict = {}
+_FP_DIRTY = False
+# fingerprint -> BlurHash string shown while the real thumbnail loads.
+_PLACEHOLDERS: dict = {}
+
+
+def source_key(which, subfolder, filename):
+    safe_sub = (subfolder or "").strip().strip("/").replace("\\", "/")
+    return "/".join(p for p in ((which or "output").lower(), safe_sub, filename or "") if p)
+
+
+def _load_fp_index():
+    global _FP_INDEX
+    if _FP_INDEX is not None:
+        return _FP_INDEX
+    try:
+        with open(INDEX_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    entries = data.get("sources")
+    placeholders = data.get("placeholders")
+    _FP_INDEX = {}
+    _FP_REFS.clear()
+    _PLACEHOLDERS.clear()
+    for key, entry in (entries if isinstance(entries, dict) else {}).items():
+        if isinstance(entry, list) and len(entry) == 3:
+            _FP_INDEX[key] = entry
+            _FP_REFS.setdefault(entry[2], set()).add(key)
+    for fp, value in (placeholders if isinstance(placeholders, dict) else {}).items():
+        if fp in _FP_REFS and isinstance(value, str):
+            _PLACEHOLDERS[fp] = value
+    return _FP_INDEX
+
+
+def flush_index():
+    """Persist the path -> fingerprint index if it changed (atomic replace)."""
+    global _FP_DIRTY
+    with _LOCK:
+        if not _FP_DIRTY or _FP_INDEX is None:
+            return
+        payload = json.dumps(
+            {"version": 1, "sources": _FP_INDEX, "placeholders": _PLACEHOLDERS},
+            separators=(",", ":"),
+        )
+        _FP_DIRTY = False
+    tmp = f"{INDEX_FILE}.tmp"
+    try:
+        os.makedirs(THUMBS_DIR, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp, INDEX_FILE)
+    except OSError as err:
+        logger.warning("CozyGen: failed to write thumbnail index: %s", err)
+        with _LOCK:
+            _FP_DIRTY = True
+
+
+def compute_fingerprint(src, size):
+    """Hash the size plus head/middle/tail samples (whole file when small)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode("ascii"))
+    with open(src, "rb") as f:
+        if size <= _FP_FULL_HASH_MAX:
+            h.update(f.read())
+        else:
+            for offset in (0, (size - _FP_SAMPLE_BYTES) // 2, size - _FP_SAMPLE_BYTES):
+                f.seek(offset)
+                h.update(f.read(_FP_SAMPLE_BYTES))
+    return h.hexdigest()
+
+
+def cached_fingerprint(which, subfolder, filename, st):
+    """Return the indexed fingerprint if the source's size/mtime still match, else None."""
+    with _LOCK:
+        entry = _load_fp_index().get(source_key(which, subfolder, filename))
+    if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+        return entry[2]
+    return None
+
+
+def remember_fingerprint(which, subfolder, filename, st, fp):
+    global _FP_DIRTY
+    key = source_key(which, subfolder, filename)
+    with _LOCK:
+        old = _load_fp_index().get(key)
+        if old and old[2] != fp:
+            _unref(key, old[2])
+        _FP_INDEX[key] = [st.st_size, st.st_mtime_ns, fp]
+        _FP_REFS.setdefault(fp, set()).add(key)
+        _FP_DIRTY = True
+
+
+def fingerprint_for(which, subfolder, filename, src, st):
+    """Return the content fingerprint for a source, reusing the index while size/mtime match."""
+    fp = cached_fingerprint(which, subfolder, filename, st)
+    if fp is None:
+        fp = compute_fingerprint(src, st.st_size)
+        remember_fingerprint(which, subfolder, filename, st, fp)
+    return fp
+
+
+def _unref(key, fp):
+    refs = _FP_REFS.get(fp)
+    if refs is not None:
+        refs.discard(key)
+        if not refs:
+            _FP_REFS.pop(fp, None)
+            _PLACEHOLDERS.pop(fp, None)
+
+
+def get_placeholder(fp):
+    with _LOCK:
+        _load_fp_index()
+        return _PLACEHOLDERS.get(fp)
+
+
+def set_placeholder(fp, value):
+    global _FP_DIRTY
+    with _LOCK:
+        _load_fp_index()
+        if _PLACEHOLDERS.get(fp) != value:
+            _PLACEHOLDERS[fp] = value
+            _FP_DIRTY = True
+
+
+def placeholders_for(which, items):
+    """Look up cached placeholders for gallery items without touching the source files."""
+    found = []
+    with _LOCK:
+        index = _load_fp_index()
+        for item in items:
+            entry = index.get(source_key(which, item.get("subfolder"), item.get("filename")))
+            found.append(_PLACEHOLDERS.get(entry[2]) if entry else None)
+    return found
+
+
+def render_path(fp, variant):
+    """Path of one cached render, e.g. ``render_path(fp, "w384.jpg")``."""
+    dest_dir = os.path.join(CAS_DIR, fp[:2])
+    os.makedirs(dest_dir, exist_ok=True)
+    return os.path.join(dest_dir, f"{fp}__{variant}")
+
+
+def _forget(path):
+    global _TOTAL_BYTES
+    entry = _ENTRIES.pop(path, None)
+    if entry is not None:
+        _TOTAL_BYTES -= entry[0]
+    return entry
+
+
+def _put(path, size, last_access):
+    global _TOTAL_BYTES
+    _forget(path)
+    _ENTRIES[path] = [size, last_access]
+    _TOTAL_BYTES += size
+
+
+def _scan_disk():
+    found = []
+    for root, _dirs, files in os.walk(THUMBS_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            if path == INDEX_FILE or name.endswith((".tmp", ".part")):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # noatime mounts never advance st_atime, so fall back to mtime.
+            found.append((max(st.st_atime, st.st_mtime), path, st.st_size))
+    found.sort()
+    return found
+
+
+def _ensure_index():
+    global _INDEXED, _TOTAL_BYTES
+    if _INDEXED:
+        return
+    found = _scan_disk()
+    with _LOCK:
+        if _INDEXED:
+            return
+        # Entries registered while the scan ran are newer than anything on disk.
+        live = list(_ENTRIES.items())
+        _ENTRIES.clear()
+        _TOTAL_BYTES = 0
+        for last_access, path, size in found:
+            _put(path, size, last_access)
+        for path, (size, last_access) in live:
+            _put(path, size, last_access)
+        _INDEXED = True
+
+
+def record_hit(path, st=None):
+    """Count a cache hit and refresh the entry's position in the LRU order."""
+    now = time.time()
+    with _LOCK:
+        _STATS["hits"] += 1
+        entry = _ENTRIES.get(path)
+        if entry is None:
+            size = st.st_size if st is not None else 0
+            _put(path, size, now)
+            return
+        stale = now - entry[1] >= _ATIME_TOUCH_SECONDS
+        entry[1] = now
+        _ENTRIES.move_to_end(path)
+    if stale and st is not None:
+        # Persist the access occasionally so LRU order survives restarts.
+        try:
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+        except OSError:
+            pass
+
+
+def record_miss():
+    with _LOCK:
+        _STATS["misses"] += 1
+
+
+def register(path):
+    """Track a freshly written cache file and wake the sweeper if over budget."""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    with _LOCK:
+        _put(path, size, time.time())
+        over = _MAX_BYTES and _TOTAL_BYTES > _MAX_BYTES
+    if over:
+        _WAKE.set()
+
+
+def remove(path):
+    with _LOCK:
+        _forget(path)
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+def reclaim_source(which, subfolder, filename):
+    """Drop a deleted source from the index and its renders once nothing else shares them."""
+    global _FP_DIRTY
+    key = source_key(which, subfolder, filename)
+    with _LOCK:
+        entry = _load_fp_index().pop(key, None)
+        if entry is None:
+            return 0
+        _FP_DIRTY = True
+        fp = entry[2]
+        _unref(key, fp)
+        if fp in _FP_REFS:
+            return 0
+    removed = 0
+    for path in glob.glob(os.path.join(CAS_DIR, fp[:2], f"{glob.escape(fp)}__*")):
+        if remove(path):
+            removed += 1
+    if removed:
+        with _LOCK:
+            _STATS["reclaimed"] += removed
+    return removed
+
+
+def prune_sources(source_base):
+    """Drop index entries whose source is gone (moved, renamed or deleted behind our back).
+
+    ``source_base(which)`` maps the first key segment to its directory. Renders are
+    reclaimed through reclaim_source, so ones still shared by another path stay.
+    """
+    with _LOCK:
+        keys = list(_load_fp_index())
+    pruned = 0
+    for key in keys:
+        which, _sep, rel = key.partition("/")
+        if rel and os.path.exists(os.path.join(source_base(which), rel)):
+            continue
+        reclaim_source(which, "", rel)
+        pruned += 1
+    if pruned:
+        with _LOCK:
+            _STATS["pruned"] += pruned
+    return pruned
+
+
+def evict(target_bytes=None):
+    """Remove least-recently-used files until the cache fits in ``target_bytes``."""
+    global _TOTAL_BYTES
+    _ensure_index()
+    if target_bytes is None:
+        target_bytes = int(_MAX_BYTES * _LOW_WATER_RATIO)
+    victims = []
+    with _LOCK:
+        while _ENTRIES and _TOTAL_BYTES > target_bytes:
+            path, (size, _) = _ENTRIES.popitem(last=False)
+            _TOTAL_BYTES -= size
+            victims.append((path, size))
+    freed = 0
+    for path, size in victims:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            logger.warning("CozyGen: failed to evict thumbnail %s: %s", path, err)
+            continue
+        freed += size
+    if victims:
+        with _LOCK:
+            _STATS["evictions"] += len(victims)
+            _STATS["evicted_bytes"] += freed
+    return len(victims)
+
+
+def clear():
+    global _TOTAL_BYTES, _FP_INDEX, _FP_DIRTY
+    with _LOCK:
+        _ENTRIES.clear()
+        _TOTAL_BYTES = 0
+        _FP_INDEX = {}
+        _FP_REFS.clear()
+        _PLACEHOLDERS.clear()
+        _FP_DIRTY = False
+        if os.path.exists(THUMBS_DIR):
+            shutil.rmtree(THUMBS_DIR)
+        os.makedirs(THUMBS_DIR, exist_ok=True)
+
+
+def stats():
+    with _LOCK:
+        hits = _STATS["hits"]
+        misses = _STATS["misses"]
+        lookups = hits + misses
+        return {
+            "size_bytes": _TOTAL_BYTES,
+            "max_bytes": _MAX_BYTES,
+            "entries": len(_ENTRIES),
+            "sources": len(_FP_INDEX or {}),
+            "fingerprints": len(_FP_REFS),
+            "indexed": _INDEXED,
+            "hit_rate": (hits / lookups) if lookups else None,
+            **_STATS,
+        }
+
+
+def _sweep_loop(source_base):
+    last_prune = 0.0
+    while True:
+        try:
+            _ensure_index()
+            if _MAX_BYTES and _TOTAL_BYTES > _MAX_BYTES:
+                evict()
+            if source_base is not None and time.time() - last_prune >= _PRUNE_INTERVAL_SECONDS:
+                last_prune = time.time()
+                prune_sources(source_base)
+            flush_index()
+        except Exception as err:
+            logger.warning("CozyGen: thumbnail cache sweep failed: %s", err)
+        _WAKE.wait(_SWEEP_INTERVAL_SECONDS)
+        _WAKE.clear()
+
+
+def start_sweeper(source_base=None):
+    """Start the background eviction/index-flush thread (idempotent).
+
+    With ``source_base`` the thread also prunes index entries for missing sources
+    every _PRUNE_INTERVAL_SECONDS, starting with the first sweep.
+    """
+    global _SWEEPER
+    if _SWEEPER is not None:
+        return
+    os.makedirs(THUMBS_DIR, exist_ok=True)
+    atexit.register(flush_index)
+    _SWEEPER = threading.Thread(target=_sweep_loop, args=(source_base,), name="cozygen-thumb-sweeper", daemon=True)
+    _SWEEPER.start()
@@ -0,0 +1,215 @@
+import re
+
+# Python port of injectFormValues (js/src/features/workflow/utils/workflowGraph.js),
+# getPromptTargets (promptOverrides.js) and the generate path of useExecutionQueue.
+# Graphs are treated as immutable: every function copies only the nodes it changes,
+# so one parsed workflow can be shared by all requests.
+INPUT_TYPES = (
+    "CozyGenDynamicInput",
+    "CozyGenImageInput",
+    "CozyGenFloatInput",
+    "CozyGenIntInput",
+    "CozyGenStringInput",
+    "CozyGenChoiceInput",
+)
+_DEFAULT_VALUE_TYPES = {"CozyGenFloatInput", "CozyGenIntInput", "CozyGenStringInput", "CozyGenDynamicInput"}
+_IMAGE_PARAM_DEFAULT = "Image Input"
+_PROMPT_PARAM_RE = re.compile(r"prompt|positive|text", re.ASCII | re.IGNORECASE)
+_NEGATIVE_PARAM_RE = re.compile(r"negative|neg", re.ASCII | re.IGNORECASE)
+ALIAS_TOKEN_RE = re.compile(r"\$[a-z0-9_:-]+\$", re.ASCII | re.IGNORECASE)
+_ARRAY_INDEX_RE = re.compile(r"0|[1-9][0-9]*")
+_MISSING = object()
+
+
+def _js_key_order(keys):
+    """Keys in JavaScript's enumeration order: array indices ascending, then the rest as inserted."""
+    indices = []
+    others = []
+    for key in keys:
+        if _ARRAY_INDEX_RE.fullmatch(key) and int(key) < 2**32 - 1:
+            indices.append(key)
+        else:
+            others.append(key)
+    return sorted(indices, key=int) + others
+
+
+def _coalesce(*values):
+    """JavaScript's `a ?? b ?? c`."""
+    for value in values:
+        if value is not None:
+            return value
+    return None
+
+
+def _same(a, b) -> bool:
+    return type(a) is type(b) and a == b
+
+
+def input_node_ids(graph: dict, types=INPUT_TYPES) -> list:
+    """Ids of the CozyGen input nodes in the order the browser form lists them."""
+    return [
+        node_id
+        for node_id in _js_key_order(graph)
+        if isinstance(graph[node_id], dict) and graph[node_id].get("class_type") in types
+    ]
+
+
+def _has_alias_text(value) -> bool:
+    if isinstance(value, str):
+        return "$" in value or "::" in value
+    if isinstance(value, list):
+        return any(_has_alias_text(v) for v in value)
+    if isinstance(value, dict):
+        return any(_has_alias_text(v) for v in value.values())
+    return False
+
+
+def alias_node_ids(graph: dict) -> list:
+    """Nodes holding text that alias expansion could change; all others expand to themselves."""
+    return [node_id for node_id, node in graph.items() if _has_alias_text(node)]
+
+
+def _param_label(inputs) -> str:
+    return str(inputs.get("param_name") or "").strip()
+
+
+def _is_prompt_param(name: str) -> bool:
+    return bool(name) and not _NEGATIVE_PARAM_RE.search(name) and bool(_PROMPT_PARAM_RE.search(name))
+
+
+def prompt_node_ids(graph: dict) -> list:
+    """Nodes getPromptTargets may report; injection never changes which ones qualify."""
+    ids = []
+    for node_id, node in graph.items():
+        inputs = node.get("inputs") if isinstance(node, dict) else None
+        if not isinstance(inputs, dict):
+            continue
+        if _is_prompt_param(_param_label(inputs).lower()) or "textencode" in str(node.get("class_type") or "").lower():
+            ids.append(node_id)
+    return ids
+
+
+def prompt_targets(graph: dict, node_ids=None) -> list:
+    """Port of getPromptTargets: [{key, label, text}] for prompt inputs and text-encode nodes."""
+    targets = []
+    for node_id in graph if node_ids is None else node_ids:
+        node = graph.get(node_id)
+        inputs = node.get("inputs") if isinstance(node, dict) else None
+        if not isinstance(inputs, dict):
+            continue
+        label = _param_label(inputs)
+        if _is_prompt_param(label.lower()):
+            fields = []
+            if isinstance(inputs.get("default_value"), str):
+                fields.append("default_value")
+            if isinstance(inputs.get("value"), str) and inputs.get("value") != inputs.get("default_value"):
+                fields.append("value")
+            if fields:
+                targets.append({"key": f"{node_id}:{fields[0]}", "label": label, "text": inputs[fields[0]]})
+            continue
+        class_type = str(node.get("class_type") or "")
+        if "textencode" in class_type.lower() and isinstance(inputs.get("text"), str):
+            targets.append(
+                {"key": f"{node_id}:text", "label": f"{class_type or 'Text Encode'} {node_id}", "text": inputs["text"]}
+            )
+    return targets
+
+
+def prompt_raw_targets(graph: dict, node_ids, form: dict) -> dict:
+    """The `<node>:<field>` -> raw text map stored as prompt_raw: prompts that still reference aliases."""
+    raw = {}
+    for target in prompt_targets(graph, node_ids):
+        value = form.get(target["label"])
+        candidate = value if isinstance(value, str) else target["text"]
+        if ALIAS_TOKEN_RE.search(candidate):
+            raw[target["key"]] = candidate
+    return raw
+
+
+def inject_form_values(graph: dict, node_ids, form: dict):
+    """Port of injectFormValues that leaves graph untouched.
+
+    Returns (prompt, form with defaults filled in, ids of the nodes that were copied).
+    A choice node only falls back to `choices[0]` when the node itself carries choices.
+    """
+    prompt = dict(graph)
+    updated = dict(form or {})
+    changed = []
+    for node_id in node_ids:
+        node = prompt.get(node_id)
+        inputs = node.get("inputs") if isinstance(node, dict) else None
+        if not isinstance(inputs, dict):
+            continue
+        param = inputs.get("param_name")
+        class_type = node.get("class_type")
+        if not param or not isinstance(param, str) or class_type == "CozyGenImageInput":
+            continue
+
+        value = updated.get(param, _MISSING)
+        if value is _MISSING:
+            if class_type == "CozyGenChoiceInput":
+                choices = inputs.get("choices")
+                first = choices[0] if isinstance(choices, list) and choices else None
+                value = _coalesce(inputs.get("value"), inputs.get("default_choice"), first, "")
+            else:
+                value = inputs.get("default_value", _MISSING)
+        if value is _MISSING:
+            value = ""
+        updated[param] = value
+
+        if class_type in _DEFAULT_VALUE_TYPES:
+            field = "default_value"
+        elif class_type == "CozyGenChoiceInput":
+            field = "value"
+        else:
+            continue
+        if _same(inputs.get(field, _MISSING), value):
+            continue
+        prompt[node_id] = {**node, "inputs": {**inputs, field: value}}
+        changed.append(node_id)
+    return prompt, updated, changed
+
+
+def inject_image_inputs(prompt: dict, node_ids, form: dict) -> list:
+    """Set image_filename on CozyGenImageInput nodes of a prompt from inject_form_values.
+
+    Replaces (never mutates) the affected nodes and returns their ids; raises ValueError
+    naming the first image input without a file, like the browser's generate check.
+    """
+    changed = []
+    for node_id in node_ids:
+        node = prompt.get(node_id)
+        inputs = node.get("inputs") if isinstance(node, dict) else None
+        if not isinstance(inputs, dict):
+            continue
+        param = inputs.get("param_name") or _IMAGE_PARAM_DEFAULT
+        filename = form.get(param)
+        if not filename:
+            raise ValueError(f'Please upload or select an image for "{param}" before generating.')
+        if not _same(inputs.get("image_filename", _MISSING), filename):
+            prompt[node_id] = {**node, "inputs": {**inputs, "image_filename": filename}}
+            changed.append(node_id)
+    return changed
+
+
+def expand_value(value, expand):
+    """Apply expand() to every string inside value; containers are copied only when something changed."""
+    if isinstance(value, str):
+        result = expand(value)
+        return value if result == value else result
+    if isinstance(value, list):
+        items = [expand_value(item, expand) for item in value]
+        return value if all(a is b for a, b in zip(items, value)) else items
+    if isinstance(value, dict):
+        items = {key: expand_value(item, expand) for key, item in value.items()}
+        return value if all(items[key] is item for key, item in value.items()) else items
+    return value
+
+
+def expand_nodes(prompt: dict, node_ids, expand) -> None:
+    """Alias-expand the given nodes of a prompt in place (the nodes themselves are replaced, not edited)."""
+    for node_id in node_ids:
+        node = prompt.get(node_id)
+        expanded = expand_value(node, expand)
+        if expanded is not node:
+            prompt[node_id] = expanded
@@ -0,0 +1,188 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .workflow_graph import (
+    alias_node_ids,
+    expand_nodes,
+    inject_form_values,
+    inject_image_inputs,
+    input_node_ids,
+    prompt_node_ids,
+    prompt_raw_targets,
+)
+
+EXT_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKFLOWS_DIR = os.path.join(EXT_DIR, "workflows")
+
+# name -> Workflow, re-parsed when the file's (mtime_ns, size) changes. The directory
+# listing is rebuilt by a watcher thread when the directory's mtime changes, which
+# also drops cached workflows whose files were removed.
+_POLL_SECONDS = 2.0
+_GZIP_MIN_BYTES = 1024
+_LOCK = threading.Lock()
+_CACHE: dict = {}
+_LISTING = None
+_DIR_SIGNATURE = None
+_WATCHER = None
+
+logger = logging.getLogger(__name__)
+
+
+def _etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+class Workflow:
+    """A parsed workflow file plus the node ids the generate path needs.
+
+    `graph` is shared by every request and must never be modified; render()
+    returns a copy-on-write prompt instead.
+    """
+
+    def __init__(self, name, signature, graph):
+        self.name = name
+        self.signature = signature
+        self.graph = graph
+        self.input_ids = input_node_ids(graph)
+        self.image_ids = input_node_ids(graph, ("CozyGenImageInput",))
+        self.alias_ids = alias_node_ids(graph)
+        self.prompt_ids = prompt_node_ids(graph)
+        self._encoded = None
+        self._gzipped = None
+
+    def encoded(self, compressed=False):
+        """(body bytes, strong ETag, gzipped) for serving the graph, encoded once per file version.
+
+        With compressed=True the gzip representation is returned when it is worth it; it
+        carries its own ETag since it is a different representation of the same graph.
+        """
+        if self._encoded is None:
+            body = json.dumps(self.graph, separators=(",", ":")).encode("utf-8")
+            self._encoded = (body, _etag(body))
+        body, etag = self._encoded
+        if not compressed or len(body) < _GZIP_MIN_BYTES:
+            return body, etag, False
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(body, compresslevel=6, mtime=0)
+        return self._gzipped, f'{etag[:-1]}-gzip"', True
+
+    def render(self, form_values, lookup=None):
+        """Build the prompt the browser would queue for form_values.
+
+        Returns (prompt, form values with defaults filled in, prompt_raw map). Raises
+        ValueError when an image input has no file.
+        """
+        form = dict(form_values or {})
+        expanded_form = lookup.expand_form(form) if lookup is not None else form
+        prompt, updated, changed = inject_form_values(self.graph, self.input_ids, expanded_form)
+        # Persist the user's raw input (aliases intact) on top of the resolved defaults.
+        resolved = {**updated, **form}
+        changed += inject_image_inputs(prompt, self.image_ids, resolved)
+        prompt_raw = prompt_raw_targets(prompt, self.prompt_ids, form)
+        if lookup is not None:
+            expand_nodes(prompt, dict.fromkeys(changed + self.alias_ids), lookup.expand)
+        return prompt, resolved, prompt_raw
+
+
+def workflow_path(name):
+    """Path of a workflow file, or None for names that would leave the workflows directory."""
+    if not isinstance(name, str) or name in ("", ".", "..") or "\\" in name or os.path.basename(name) != name:
+        return None
+    return os.path.join(WORKFLOWS_DIR, name)
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load(name):
+    """Cached Workflow for a file name; None if it does not exist.
+
+    Raises ValueError when the file is not a JSON object. Parses outside the lock,
+    so call it from a worker thread for large workflows.
+    """
+    path = workflow_path(name)
+    signature = _file_signature(path) if path else None
+    if signature is None:
+        return None
+    with _LOCK:
+        cached = _CACHE.get(name)
+    if cached is not None and cached.signature == signature:
+        return cached
+
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            graph = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"bad json: {e}") from e
+    if not isinstance(graph, dict):
+        raise ValueError("workflow must be a JSON object")
+    workflow = Workflow(name, signature, graph)
+    with _LOCK:
+        _CACHE[name] = workflow
+    return workflow
+
+
+def _dir_signature():
+    try:
+        return os.stat(WORKFLOWS_DIR).st_mtime_ns
+    except OSError:
+        return None
+
+
+def refresh():
+    """Rescan the workflows directory if it changed since the last scan."""
+    global _LISTING, _DIR_SIGNATURE
+    signature = _dir_signature()
+    with _LOCK:
+        if _LISTING is not None and signature == _DIR_SIGNATURE:
+            return
+    try:
+        present = set(os.listdir(WORKFLOWS_DIR)) if signature is not None else set()
+    except OSError:
+        present = set()
+    names = sorted(f for f in present if f.endswith(".json"))
+    body = json.dumps({"workflows": names}).encode("utf-8")
+    with _LOCK:
+        _LISTING = (names, body, _etag(body))
+        _DIR_SIGNATURE = signature
+        for name in [name for name in _CACHE if name not in present]:
+            del _CACHE[name]
+
+
+def listing():
+    """(names, JSON body bytes, ETag) for the /cozygen/workflows response."""
+    with _LOCK:
+        current = _LISTING
+    if current is None:
+        refresh()
+        with _LOCK:
+            current = _LISTING
+    return current
+
+
+def _watch():
+    while True:
+        try:
+            refresh()
+        except Exception as e:
+            logger.warning("CozyGen: workflow directory watcher failed: %s", e)
+        time.sleep(_POLL_SECONDS)
+
+
+def start_watcher():
+    """Keep the workflow listing current in the background (idempotent)."""
+    global _WATCHER
+    if _WATCHER is not None:
+        return
+    _WATCHER = threading.Thread(target=_watch, name="cozygen-workflow-watcher", daemon=True)
+    _WATCHER.start()
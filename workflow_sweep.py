@@ -0,0 +1,180 @@
+import itertools
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+MODES = ("cartesian", "zip")
+MAX_ITEMS = 10000
+_ERRORS_KEPT = 20
+_FINISHED_KEPT = 64
+
+_LOCK = threading.Lock()
+# sweep id -> Sweep, oldest first; finished sweeps beyond _FINISHED_KEPT are dropped.
+_SWEEPS: "OrderedDict[str, Sweep]" = OrderedDict()
+
+
+def _number(value, what):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{what} must be a number")
+    return value
+
+
+def _numeric_range(param, spec):
+    """Inclusive start..stop by step; ints stay ints, floats are rounded to drop binary noise."""
+    if not isinstance(spec, dict):
+        raise ValueError(f"range for {param!r} must be an object")
+    start = _number(spec.get("start"), f"{param}.range.start")
+    stop = _number(spec.get("stop"), f"{param}.range.stop")
+    step = _number(spec.get("step", 1), f"{param}.range.step")
+    if step == 0 or (stop - start) * step < 0:
+        raise ValueError(f"range for {param!r} never reaches its stop")
+    count = math.floor((stop - start) / step + 1e-9) + 1
+    if count > MAX_ITEMS:
+        raise ValueError(f"range for {param!r} has more than {MAX_ITEMS} values")
+    if all(isinstance(v, int) for v in (start, stop, step)):
+        return range(start, start + count * step, step)
+    return [round(start + i * step, 10) for i in range(count)]
+
+
+def _seed_range(param, spec):
+    if not isinstance(spec, dict):
+        raise ValueError(f"seeds for {param!r} must be an object")
+    start = spec.get("start", 0)
+    count = spec.get("count")
+    if isinstance(start, bool) or not isinstance(start, int) or start < 0:
+        raise ValueError(f"seeds for {param!r} need a non-negative integer start")
+    if isinstance(count, bool) or not isinstance(count, int) or not 0 < count <= MAX_ITEMS:
+        raise ValueError(f"seeds for {param!r} need a count between 1 and {MAX_ITEMS}")
+    return range(start, start + count)
+
+
+def parse_axes(axes, mode="cartesian") -> list:
+    """Validate sweep axes and return [(param, values)] with values as lists or ranges.
+
+    Each axis is {"param": name} plus one of:
+    - "values": [...] an explicit list
+    - "range": {"start", "stop", "step"} numbers, stop included
+    - "seeds": {"start", "count"} consecutive integer seeds
+    In zip mode every axis must have the same length. Raises ValueError on invalid input.
+    """
+    if not isinstance(axes, list) or not axes:
+        raise ValueError("axes must be a non-empty list")
+    parsed = []
+    seen = set()
+    for axis in axes:
+        param = axis.get("param") if isinstance(axis, dict) else None
+        if not isinstance(param, str) or not param:
+            raise ValueError("every axis needs a param name")
+        if param in seen:
+            raise ValueError(f"param {param!r} appears in more than one axis")
+        seen.add(param)
+        if "values" in axis:
+            values = axis["values"]
+            if not isinstance(values, list) or not values:
+                raise ValueError(f"values for {param!r} must be a non-empty list")
+            if len(values) > MAX_ITEMS:
+                raise ValueError(f"values for {param!r} has more than {MAX_ITEMS} entries")
+        elif "range" in axis:
+            values = _numeric_range(param, axis["range"])
+        elif "seeds" in axis:
+            values = _seed_range(param, axis["seeds"])
+        else:
+            raise ValueError(f"axis {param!r} needs values, range or seeds")
+        if not len(values):
+            raise ValueError(f"axis {param!r} is empty")
+        parsed.append((param, values))
+    if mode == "zip" and len({len(values) for _param, values in parsed}) > 1:
+        lengths = ", ".join(f"{param}={len(values)}" for param, values in parsed)
+        raise ValueError(f"zip mode needs axes of equal length ({lengths})")
+    return parsed
+
+
+def combination_count(axes, mode="cartesian") -> int:
+    lengths = [len(values) for _param, values in axes]
+    return lengths[0] if mode == "zip" else math.prod(lengths)
+
+
+def combinations(axes, mode="cartesian"):
+    """Lazily yield {param: value} overrides: every combination (first axis slowest), or zipped."""
+    params = [param for param, _values in axes]
+    columns = [values for _param, values in axes]
+    rows = zip(*columns) if mode == "zip" else itertools.product(*columns)
+    for row in rows:
+        yield dict(zip(params, row))
+
+
+class Sweep:
+    """Progress of one sweep. Counters are updated by the enqueue task only."""
+
+    def __init__(self, workflow, total, mode):
+        self.id = uuid.uuid4().hex
+        self.workflow = workflow
+        self.total = total
+        self.mode = mode
+        self.created = time.time()
+        self.finished = None
+        self.status = "running"
+        self.enqueued = 0
+        self.failed = 0
+        self.errors = []
+        self.prompt_ids = []
+        self.cancelled = False
+        self.task = None
+
+    def record(self, prompt_id, error=None):
+        if error is None:
+            self.prompt_ids.append(prompt_id)
+            self.enqueued += 1
+            return
+        self.failed += 1
+        if len(self.errors) < _ERRORS_KEPT:
+            self.errors.append({"prompt_id": prompt_id, "error": error})
+
+    def finish(self, status):
+        self.status = status
+        self.finished = time.time()
+        _prune()
+
+    def snapshot(self, pending_ids=frozenset(), running_ids=frozenset(), include_ids=False) -> dict:
+        mine = set(self.prompt_ids)
+        pending = len(mine & pending_ids)
+        running = len(mine & running_ids)
+        data = {
+            "sweep_id": self.id,
+            "workflow": self.workflow,
+            "mode": self.mode,
+            "status": self.status,
+            "total": self.total,
+            "enqueued": self.enqueued,
+            "failed": self.failed,
+            "pending": pending,
+            "running": running,
+            "completed": self.enqueued - pending - running,
+            "errors": list(self.errors),
+            "created": self.created,
+            "finished": self.finished,
+        }
+        if include_ids:
+            data["prompt_ids"] = list(self.prompt_ids)
+        return data
+
+
+def register(sweep: Sweep) -> Sweep:
+    with _LOCK:
+        _SWEEPS[sweep.id] = sweep
+    _prune()
+    return sweep
+
+
+def get(sweep_id):
+    with _LOCK:
+        return _SWEEPS.get(sweep_id)
+
+
+def _prune():
+    with _LOCK:
+        finished = [key for key, sweep in _SWEEPS.items() if sweep.finished is not None]
+        for key in finished[: max(0, len(finished) - _FINISHED_KEPT)]:
+            _SWEEPS.pop(key, None)